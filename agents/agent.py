@@ -1,4 +1,6 @@
 class Agent:
+    # position of the agent in the simulation registry, events refer to agents by it
+    index = None
 
     def think(self, event, environment_info):
         pass
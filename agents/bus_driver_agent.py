@@ -6,7 +6,7 @@ from agents.agent import Agent
 from environment.environment import DriverEnvironment
 from events.event import Event, EventType
 from map.map_elements import ElementType, Block, Route
-from routing.routing import path_search
+from routing.routing import path_search, perturbed_weights, edge_weights
 
 
 class DriverStatus(Enum):
@@ -28,7 +28,7 @@ class BusDriverAgent(Agent):
         route: The route that the bus driver follows.
     """
 
-    def __init__(self, route, wait_time):
+    def __init__(self, route, wait_time, seed=None):
         self.id = str(uuid.uuid4())
 
         self.trip = 0
@@ -37,6 +37,8 @@ class BusDriverAgent(Agent):
         self.wait_time = wait_time
         self.status = DriverStatus.IDLE
         self.ability = random.uniform(0.5, 1)
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.weights = None
 
         self.time_ranges = {
             ElementType.STOP: (2, 5),
@@ -46,6 +48,20 @@ class BusDriverAgent(Agent):
             ElementType.TRAIN_RAIL: (0, 7)
         }
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["weights"] = None
+        return state
+
+    def route_weights(self, graph):
+        """
+        Returns the block costs as this driver perceives them, drawn once per graph from the driver's own seed.
+        """
+        if self.weights is None or self.weights.base is not edge_weights(graph):
+            self.weights = perturbed_weights(graph, self.ability, self.seed)
+
+        return self.weights
+
     def think(self, event, environment_info: DriverEnvironment):
         """
         Decides the action to take based on the current environment_info.
@@ -144,8 +160,8 @@ class BusDriverAgent(Agent):
         Performs the 'refuel' action for the given agent.
         """
         detour = path_search(environment_info.map, self.current_route[environment_info.current_position].id,
-                             environment_info.gas_stations, [], self.ability,
-                             False)
+                             environment_info.gas_stations, [], 1,
+                             False, weights=self.route_weights(environment_info.map))
 
         self.current_route = [environment_info.map.nodes[idx] for idx in detour[1]]
         return Event(environment_info.time, EventType.DEPARTURE, self)
@@ -155,7 +171,7 @@ class BusDriverAgent(Agent):
 
         detour = path_search(environment_info.map, self.current_route[environment_info.current_position].id,
                              [self.current_route[len(self.current_route) - 1].id], [], self.ability,
-                             False)
+                             False, weights=self.route_weights(environment_info.map))
 
         self.current_route = [environment_info.map.nodes[idx] for idx in detour[1]]
         return Event(environment_info.time, EventType.DEPARTURE, self)
@@ -175,7 +191,7 @@ class BusDriverAgent(Agent):
 
             detour = path_search(environment_info.map, self.current_route[environment_info.current_position].id,
                                  [self.current_route[last_index].id], environment_info.obstacles_blocks, self.ability,
-                                 False)
+                                 False, weights=self.route_weights(environment_info.map))
 
         self.current_route[environment_info.current_position + 1: last_index + 1] = [environment_info.map.nodes[idx] for idx
                                                                                      in detour[1]]
@@ -210,7 +226,7 @@ class BusDriverAgent(Agent):
 
         detour = path_search(environment_info.map, self.current_route[environment_info.current_position].id,
                              [self.current_route[0].id], [], self.ability,
-                             False)
+                             False, weights=self.route_weights(environment_info.map))
 
         self.current_route = [environment_info.map.nodes[idx] for idx in detour[1]]
         return Event(environment_info.time, EventType.DEPARTURE, self)
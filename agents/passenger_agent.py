@@ -5,7 +5,7 @@ import uuid
 from enum import Enum, auto
 
 from agents.agent import Agent
-from environment.environment import PassengerEnvironment
+from environment.environment import PassengerEnvironment, NO_DRIVER
 from events.event import Event, EventType
 from routing import routing
 from routing.routing import get_routes, path_search
@@ -17,6 +17,14 @@ def time_to_minutes(time_str):
     return total_minutes
 
 
+def route_refs(actions):
+    """
+    Returns:
+        set[str]: refs of the routes among the actions of a route position, whose arguments are "ref:direction".
+    """
+    return {action.split(":")[0] for action in actions if action != "walk"}
+
+
 class PlanType(Enum):
     GO_TO_WORK = 1
     RANDOM_TRAVEL = 2
@@ -149,6 +157,9 @@ class PassengerAgent(Agent):
             else:
                 return PassengerStatus.WAITING
 
+        if event.event_type == EventType.BOARD_VEHICLE:
+            return PassengerStatus.ON_VEHICLE
+
         if event.event_type == EventType.ROUTE_ENDED_ABRUPTLY:
             return PassengerStatus.SEARCH_ALTERNATIVE
 
@@ -170,9 +181,10 @@ class PassengerAgent(Agent):
 
         if status == PassengerStatus.OFF_VEHICLE:
             environment_info.current_bus_route = ""
-            environment_info.current_driver = ""
+            environment_info.current_driver = NO_DRIVER
             self.status = PassengerStatus.WAITING
-            return []
+            environment_info.current_position += 1
+            return self.walk_to_stop(environment_info, False)
 
         if status == PassengerStatus.ARRIVAL_AT_STOP:
             return self.arrive_at_stop(environment_info)
@@ -199,12 +211,25 @@ class PassengerAgent(Agent):
 
         return time
 
+    def accepted_refs(self, position):
+        return route_refs(self.route[position][1])
+
+    def alighting_position(self, position, ref):
+        """
+        Returns:
+            int: position of the route where the passenger gets off a vehicle of the route ref boarded at position.
+        """
+        while position < len(self.route) - 1 and ref in self.accepted_refs(position + 1):
+            position += 1
+
+        return position
+
     def decide_boarding_vehicle(self, environment_info: PassengerEnvironment):
-        return environment_info.bus_at_stop in self.route[environment_info.current_position]
+        return environment_info.bus_at_stop in self.accepted_refs(environment_info.current_position)
 
     def decide_leave_vehicle(self, environment_info):
         return (environment_info.current_position == len(self.route) - 1
-                or environment_info.bus_at_stop not in self.route[environment_info.current_position + 1])
+                or environment_info.bus_at_stop not in self.accepted_refs(environment_info.current_position + 1))
 
     def walk_to_stop(self, environment_info: PassengerEnvironment, explore=True):
 
@@ -286,7 +311,7 @@ class PassengerAgent(Agent):
             return Event(environment_info.time, EventType.AT_STOP, self)
 
     def search_alternative(self, environment_info):
-        self.current_block = self.route[environment_info.current_position]
+        self.current_block = environment_info.map.nodes[self.route[environment_info.current_position][0]]
         return self.walk_to_stop(environment_info)
 
     def start_plan(self, environment_info):
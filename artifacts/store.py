@@ -0,0 +1,212 @@
+import hashlib
+import importlib
+import json
+import os
+from pathlib import Path
+
+import dill
+import numpy as np
+
+HIT = "hit"
+MISS = "miss"
+LEGACY = "legacy"
+
+
+class FileInput:
+    """
+    Input of a stage given by the content of a file.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def fingerprint(self, store):
+        return "file", os.path.basename(self.path), store.file_digest(self.path)
+
+
+class CodeInput:
+    """
+    Input of a stage given by the source code of the modules that compute it.
+    """
+
+    def __init__(self, *modules):
+        self.modules = modules
+
+    def fingerprint(self, store):
+        return "code", [(module, store.file_digest(importlib.import_module(module).__file__))
+                        for module in self.modules]
+
+
+class StageInput:
+    """
+    Input of a stage given by the artifact another stage produced in the same store.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def fingerprint(self, store):
+        if self.stage not in store.digests:
+            raise KeyError(f"Stage {self.stage} has not been loaded yet")
+
+        return "stage", self.stage, store.digests[self.stage]
+
+
+class PickleFormat:
+    """
+    Default artifact format, a dill pickle in which the shared objects are saved by name.
+    """
+    suffix = ".pkl"
+
+    @staticmethod
+    def read(path, shared):
+        with open(path, 'rb') as file:
+            unpickler = dill.Unpickler(file)
+            unpickler.persistent_load = lambda name: shared[name]
+            return unpickler.load()
+
+    @staticmethod
+    def write(path, artifact, shared):
+        names = {id(value): name for name, value in shared.items()}
+        temporary_path = path.with_suffix(".tmp")
+
+        with open(temporary_path, 'wb') as file:
+            pickler = dill.Pickler(file)
+            pickler.persistent_id = lambda obj: names.get(id(obj), None)
+            pickler.dump(artifact)
+
+        os.replace(temporary_path, path)
+
+
+class NpyFormat:
+    """
+    Artifact format of numpy arrays, saved with np.save.
+    """
+    suffix = ".npy"
+
+    @staticmethod
+    def read(path, shared):
+        return np.load(path)
+
+    @staticmethod
+    def write(path, artifact, shared):
+        temporary_path = path.with_suffix(".tmp")
+
+        with open(temporary_path, 'wb') as file:
+            np.save(file, artifact)
+
+        os.replace(temporary_path, path)
+
+
+class ArtifactStore:
+    """
+    Content addressed store of the artifacts produced by every stage of the simulation setup. Each artifact is saved
+    under the hash of the stage inputs (files, parameters, code and upstream artifacts), so a stage is only recomputed
+    when one of its inputs changed.
+
+    Objects passed as shared are left out of the pickled artifacts and replaced on load by the live objects with the
+    same name, so artifacts do not embed copies of the maps.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.manifest_path = self.root / "manifest.json"
+        self.manifest = json.loads(self.manifest_path.read_text()) if self.manifest_path.exists() else {}
+        self.digests = {}
+        self.statuses = {}
+        self.file_digests = {}
+
+    def file_digest(self, path):
+        if not Path(path).exists():
+            return "missing"
+
+        stat = os.stat(path)
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+
+        if key not in self.file_digests:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(chunk)
+            self.file_digests[key] = digest.hexdigest()
+
+        return self.file_digests[key]
+
+    def fingerprint(self, stage, inputs):
+        values = [value.fingerprint(self) if isinstance(value, (FileInput, CodeInput, StageInput)) else value
+                  for value in inputs]
+        serialized = json.dumps([stage, values], sort_keys=True, default=repr)
+        return hashlib.sha256(serialized.encode()).hexdigest()[:32]
+
+    def artifact_path(self, stage, digest, artifact_format=PickleFormat):
+        return self.root / stage / f"{digest}{artifact_format.suffix}"
+
+    def declare(self, stage, inputs):
+        """
+        Registers the digest of a stage without loading its artifact, so stages depending on it can be looked up.
+        """
+        self.digests[stage] = self.fingerprint(stage, inputs)
+        return self.digests[stage]
+
+    def load_or_build(self, stage, inputs, build, expected_type=None, legacy=None, shared=None,
+                      artifact_format=PickleFormat):
+        """
+        Returns the artifact of a stage, loading it when one was saved for the same inputs or building and saving it
+        otherwise.
+        Args:
+            stage (str): name of the stage.
+            inputs (list): inputs of the stage, plain values or FileInput, CodeInput and StageInput.
+            build (callable): computes the artifact.
+            expected_type (type): type the artifact must have, artifacts of another type are rebuilt.
+            legacy (callable): loads the artifact saved by the code before the store existed, it is only tried the
+                first time the stage is requested. It must return None unless it checked that the artifact matches
+                the inputs, since it is saved under their digest.
+            shared (dict): live objects referenced by the artifact that must not be pickled with it.
+            artifact_format: how the artifact is written and read, a dill pickle by default.
+        Returns:
+            The artifact.
+        """
+        digest = self.fingerprint(stage, inputs)
+        path = self.artifact_path(stage, digest, artifact_format)
+        shared = shared or {}
+
+        artifact = artifact_format.read(path, shared) if path.exists() else None
+        status = HIT
+
+        if artifact is None or (expected_type and not isinstance(artifact, expected_type)):
+            artifact = None
+
+            if legacy is not None and stage not in self.manifest:
+                artifact = legacy()
+                status = LEGACY
+
+            if artifact is None or (expected_type and not isinstance(artifact, expected_type)):
+                artifact = build()
+                status = MISS
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            artifact_format.write(path, artifact, shared)
+            self.manifest[stage] = {"digest": digest, "type": type(artifact).__name__}
+            self.save_manifest()
+
+        self.digests[stage] = digest
+        self.statuses[stage] = status
+        return artifact
+
+    def save_manifest(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path.write_text(json.dumps(self.manifest, indent=2, sort_keys=True))
+
+    def report(self):
+        """
+        Returns the status (hit, miss or legacy) of every stage requested in this session.
+        """
+        return dict(self.statuses)
+
+    @property
+    def hits(self):
+        return sum(1 for status in self.statuses.values() if status == HIT)
+
+    @property
+    def misses(self):
+        return sum(1 for status in self.statuses.values() if status != HIT)
@@ -3,6 +3,8 @@ from dataclasses import dataclass
 from map.graph import Graph
 from map.map_elements import Block
 
+NO_DRIVER = -1
+
 
 @dataclass
 class Bus:
@@ -36,6 +38,9 @@ class DriverEnvironment:
     obstacle_ahead: bool
     obstacles_blocks: list[str]
 
+    # time at which the last passenger boarding at the current stop is on the bus
+    onboarding_until: float = 0
+
 
 @dataclass
 class PassengerEnvironment:
@@ -44,4 +49,4 @@ class PassengerEnvironment:
     current_position: int
     bus_at_stop: str
     current_bus_route: str
-    current_driver: str
+    current_driver: int
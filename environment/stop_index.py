@@ -0,0 +1,137 @@
+import heapq
+
+
+class StopIndex:
+    """
+    Passengers waiting at every stop and riding every vehicle, kept up to date by the simulation as they arrive at
+    stops, board and get off.
+
+    The waiting passengers of a stop are bucketed by the route refs they accept there, every bucket ordered by arrival,
+    so a bus only visits the passengers that would take it. The riders of a vehicle are bucketed by the stop where they
+    get off, so a bus only visits the passengers leaving at its current stop. Passengers are identified by their index
+    in the simulation.
+    """
+
+    def __init__(self):
+        # stop id -> route ref -> passenger index -> arrival time, dicts keep the order of arrival
+        self.queues = {}
+        # heap of (deadline, arrival time, passenger index, stop id) of the waiting passengers, entries of passengers
+        # that already left their stop are discarded lazily
+        self.deadlines = []
+        # passenger index -> (stop id, refs, arrival time)
+        self.waiting = {}
+
+        # driver index -> stop id -> indexes of the passengers getting off there, in boarding order
+        self.onboard = {}
+        # passenger index -> (driver index, stop id)
+        self.riding = {}
+
+    def wait(self, passenger, stop, refs, arrival, deadline):
+        """
+        Adds a passenger to the queues of the stop.
+        Args:
+            passenger (int): index of the passenger.
+            stop (str): id of the block of the stop.
+            refs (set[str]): refs of the routes the passenger accepts at the stop.
+            arrival (float): time at which the passenger arrived at the stop.
+            deadline (float): time after which the passenger stops waiting.
+        """
+        self.leave_stop(passenger)
+
+        queues = self.queues.setdefault(stop, {})
+
+        for ref in refs:
+            queues.setdefault(ref, {})[passenger] = arrival
+
+        heapq.heappush(self.deadlines, (deadline, arrival, passenger, stop))
+        self.waiting[passenger] = (stop, refs, arrival)
+
+    def leave_stop(self, passenger):
+        entry = self.waiting.pop(passenger, None)
+
+        if entry is None:
+            return
+
+        stop, refs, _ = entry
+        queues = self.queues[stop]
+
+        for ref in refs:
+            del queues[ref][passenger]
+
+            if not queues[ref]:
+                del queues[ref]
+
+        if not queues:
+            del self.queues[stop]
+
+    def waiting_for(self, stop, ref):
+        """
+        Returns:
+            list[int]: indexes of the passengers waiting at the stop for the route, in order of arrival.
+        """
+        return list(self.queues.get(stop, {}).get(ref, ()))
+
+    def next_deadline(self):
+        """
+        Returns:
+            float | None: earliest deadline of the waiting passengers, None if nobody is waiting.
+        """
+        while self.deadlines:
+            _, arrival, passenger, stop = self.deadlines[0]
+            entry = self.waiting.get(passenger)
+
+            if entry is not None and entry[0] == stop and entry[2] == arrival:
+                return self.deadlines[0][0]
+
+            heapq.heappop(self.deadlines)
+
+        return None
+
+    def expire_next(self):
+        """
+        Removes the waiting passenger with the earliest deadline, which must exist.
+        Returns:
+            tuple[int, float]: index of the removed passenger and its deadline.
+        """
+        self.next_deadline()
+        deadline, _, passenger, _ = heapq.heappop(self.deadlines)
+        self.leave_stop(passenger)
+
+        return passenger, deadline
+
+    def board(self, passenger, driver, stop):
+        """
+        Moves a passenger from its stop to the vehicle of the driver.
+        Args:
+            passenger (int): index of the passenger.
+            driver (int): index of the driver.
+            stop (str): id of the block of the stop where the passenger gets off.
+        """
+        self.leave_stop(passenger)
+        self.get_off(passenger)
+
+        self.onboard.setdefault(driver, {}).setdefault(stop, []).append(passenger)
+        self.riding[passenger] = (driver, stop)
+
+    def get_off(self, passenger):
+        entry = self.riding.pop(passenger, None)
+
+        if entry is None:
+            return
+
+        driver, stop = entry
+        stops = self.onboard[driver]
+        stops[stop].remove(passenger)
+
+        if not stops[stop]:
+            del stops[stop]
+
+        if not stops:
+            del self.onboard[driver]
+
+    def alighting(self, driver, stop):
+        """
+        Returns:
+            list[int]: indexes of the passengers of the driver getting off at the stop, in boarding order.
+        """
+        return list(self.onboard.get(driver, {}).get(stop, ()))
@@ -0,0 +1,200 @@
+"""
+Compares the event schedulers on a synthetic day shaped like Simulation.run: buses leave every few minutes and push a
+CONTINUE and a FUEL_SPENT event per block plus the occasional BUS_STOP and traffic signal wait, while passengers
+depart, walk to their stops and board. The plain heapq of Event objects used before the schedulers is measured as
+the baseline.
+
+The day is also recorded as a trace of pushes and pops and replayed on every scheduler, which measures the scheduler
+alone without the cost of creating the events.
+
+The schedulers are also compared on the simulation of main: its warm state, with the buses of every route added, is
+snapshotted once and every scheduler runs the day from it.
+
+Usage: python -m events.benchmark [drivers] [passengers]
+       python -m events.benchmark simulation [buses per route]
+"""
+import heapq
+import random
+import sys
+import tempfile
+import time
+
+from events.event import Event, EventType
+from events.scheduler import SCHEDULERS
+
+DAY = 1440
+SEED = 0
+
+
+class EventHeap:
+    """
+    The heapq of Event objects ordered by Event.__lt__.
+    """
+
+    def __init__(self):
+        self.heap = []
+
+    def push(self, event):
+        heapq.heappush(self.heap, event)
+
+    def pop(self):
+        return heapq.heappop(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
+
+
+def simulate_day(scheduler, drivers, passengers):
+    """
+    Runs the synthetic workload until the end of the day.
+    Returns:
+        tuple[int, float]: amount of processed events and a checksum of their times.
+    """
+    rng = random.Random(SEED)
+
+    for driver in range(drivers):
+        scheduler.push(Event(300 + (driver % 60) * 10, EventType.DEPARTURE, driver))
+
+    for passenger in range(passengers):
+        scheduler.push(Event(rng.uniform(300, 1200), EventType.DEPARTURE, -passenger - 1))
+
+    processed = 0
+    checksum = 0.0
+    now = 0
+
+    while scheduler and now < DAY:
+        event = scheduler.pop()
+        now = event.time
+        processed += 1
+        checksum += now
+
+        if event.agent_index >= 0:
+            if event.event_type in (EventType.DEPARTURE, EventType.CONTINUE):
+                block_time = rng.uniform(0.1, 1.5)
+                # a traffic signal delays the next block
+                signal_time = rng.uniform(0, 2) if rng.random() < 0.2 else 0
+
+                scheduler.push(Event(now + block_time + signal_time, EventType.CONTINUE, event.agent_index))
+                scheduler.push(Event(now + block_time, EventType.FUEL_SPENT, event.agent_index))
+
+                if rng.random() < 0.3:
+                    scheduler.push(Event(now + rng.uniform(0, block_time), EventType.BUS_STOP, event.agent_index))
+
+        elif event.event_type == EventType.DEPARTURE:
+            scheduler.push(Event(now + rng.uniform(1, 10), EventType.AT_STOP, event.agent_index))
+        elif event.event_type == EventType.AT_STOP:
+            scheduler.push(Event(now + rng.uniform(5, 30), EventType.BOARD_VEHICLE, event.agent_index))
+        elif event.event_type == EventType.BOARD_VEHICLE:
+            scheduler.push(Event(now + rng.uniform(5, 40), EventType.GET_OFF_VEHICLE, event.agent_index))
+
+    return processed, checksum
+
+
+class TraceRecorder:
+    """
+    Scheduler wrapper recording every push and pop, a pop is recorded as None.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.trace = []
+
+    def push(self, event):
+        self.trace.append(event)
+        self.scheduler.push(event)
+
+    def pop(self):
+        self.trace.append(None)
+        return self.scheduler.pop()
+
+    def __bool__(self):
+        return bool(self.scheduler)
+
+
+def replay(scheduler, trace):
+    checksum = 0.0
+
+    for event in trace:
+        if event is None:
+            checksum += scheduler.pop().time
+        else:
+            scheduler.push(event)
+
+    return checksum
+
+
+def compare_on_simulation(simulation, until=DAY):
+    """
+    Runs the simulation from its current state once per scheduler, moving the pending events into it. The state is
+    restored after every run and the events are not recorded.
+    Returns:
+        dict[str, tuple[int, float, dict]]: processed events, seconds and indicators of the run of every scheduler.
+    """
+    results = {}
+    recording = simulation.recorder.sampling
+    simulation.recorder.sampling = 0
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/warm_state.pkl"
+            simulation.snapshot(path)
+
+            for name, scheduler_class in SCHEDULERS.items():
+                simulation.restore(path)
+
+                events = scheduler_class()
+                events.extend(simulation.events)
+                simulation.events = events
+
+                start = time.perf_counter()
+                processed = simulation.run_until(until)
+                results[name] = processed, time.perf_counter() - start, simulation.metrics.kpis()
+
+            simulation.restore(path)
+    finally:
+        simulation.recorder.sampling = recording
+
+    return results
+
+
+def main_simulation(buses_per_route=1):
+    from experiments.scenarios import warm_simulation
+
+    simulation, refs = warm_simulation()
+    simulation.add_drivers(*simulation.build_drivers({ref: buses_per_route for ref in refs}, 600)[:3])
+
+    print("simulation day")
+    for name, (processed, elapsed, kpis) in compare_on_simulation(simulation).items():
+        print(f"{name:>12}: {processed} events in {elapsed:.2f}s "
+              f"({processed / elapsed / 1e6:.2f}M events/s, {kpis['trips']} trips)")
+
+
+def main(drivers=200, passengers=20000):
+    candidates = {"event heap": EventHeap} | SCHEDULERS
+
+    print("full day")
+    for name, scheduler_class in candidates.items():
+        start = time.perf_counter()
+        processed, checksum = simulate_day(scheduler_class(), drivers, passengers)
+        elapsed = time.perf_counter() - start
+
+        print(f"{name:>12}: {processed} events in {elapsed:.2f}s "
+              f"({processed / elapsed / 1e6:.2f}M events/s, checksum {checksum:.1f})")
+
+    recorder = TraceRecorder(SCHEDULERS["heap"]())
+    simulate_day(recorder, drivers, passengers)
+
+    print("scheduler operations only")
+    for name, scheduler_class in candidates.items():
+        start = time.perf_counter()
+        checksum = replay(scheduler_class(), recorder.trace)
+        elapsed = time.perf_counter() - start
+
+        print(f"{name:>12}: {len(recorder.trace)} operations in {elapsed:.2f}s (checksum {checksum:.1f})")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["simulation"]:
+        main_simulation(*map(int, sys.argv[2:]))
+    else:
+        main(*map(int, sys.argv[1:]))
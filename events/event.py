@@ -20,10 +20,17 @@ class EventType(Enum):
 
 
 class Event:
+    """
+    Event of the simulation. It refers to its agent by the agent index in the simulation and keeps its (time, event
+    type value) sort key precomputed.
+    """
+    __slots__ = ("time", "event_type", "agent_index", "key")
+
     def __init__(self, time, event_type, agent):
         self.time = time
         self.event_type = event_type
-        self.agent = agent
+        self.agent_index = agent if isinstance(agent, int) else agent.index
+        self.key = (time, event_type.value)
 
     def __lt__(self, other):
-        return self.time < other.time or (self.time == other.time and self.event_type.value <= other.event_type.value)
+        return self.key < other.key
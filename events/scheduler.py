@@ -0,0 +1,126 @@
+import heapq
+import math
+from abc import ABC, abstractmethod
+
+
+class Scheduler(ABC):
+    """
+    Queue of pending events popped in order of time and then of event type. Events with the same time and type are
+    popped in the order they were pushed. Entries are flat (time, event type value, sequence, event) tuples built from
+    the precomputed event key, so ordering them never calls back into python code.
+    """
+
+    def __init__(self):
+        self.sequence = 0
+        self.size = 0
+
+    @abstractmethod
+    def push(self, event):
+        """
+        Adds an event to the pending events.
+        """
+
+    @abstractmethod
+    def pop(self):
+        """
+        Removes and returns the first pending event.
+        """
+
+    @abstractmethod
+    def peek_time(self):
+        """
+        Returns the time of the first pending event, infinity if there is none.
+        """
+
+    @abstractmethod
+    def __iter__(self):
+        """
+        Iterates over the pending events in the order they would be popped, without removing them.
+        """
+
+    def extend(self, events):
+        for event in events:
+            self.push(event)
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+
+class HeapScheduler(Scheduler):
+    """
+    Binary heap over every pending event.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.heap = []
+
+    def push(self, event):
+        self.sequence += 1
+        time, type_value = event.key
+        heapq.heappush(self.heap, (time, type_value, self.sequence, event))
+        self.size += 1
+
+    def pop(self):
+        event = heapq.heappop(self.heap)[3]
+        self.size -= 1
+        return event
+
+    def peek_time(self):
+        return self.heap[0][0] if self.heap else math.inf
+
+    def __iter__(self):
+        return (entry[3] for entry in sorted(self.heap))
+
+
+class CalendarScheduler(Scheduler):
+    """
+    Calendar queue with one bucket per time slot of bucket_width minutes. Only the small heap of the bucket an event
+    falls into is reordered when it is pushed or popped, and the heap of bucket keys only changes when a slot gets
+    its first event or loses its last one.
+    """
+
+    def __init__(self, bucket_width=1.0):
+        super().__init__()
+        self.bucket_width = bucket_width
+        self.buckets = {}
+        self.keys = []
+
+    def push(self, event):
+        self.sequence += 1
+        time, type_value = event.key
+        entry = (time, type_value, self.sequence, event)
+        key = int(time // self.bucket_width)
+        bucket = self.buckets.get(key, None)
+
+        if bucket is None:
+            self.buckets[key] = [entry]
+            heapq.heappush(self.keys, key)
+        else:
+            heapq.heappush(bucket, entry)
+
+        self.size += 1
+
+    def pop(self):
+        key = self.keys[0]
+        bucket = self.buckets[key]
+        entry = heapq.heappop(bucket)
+
+        if not bucket:
+            del self.buckets[key]
+            heapq.heappop(self.keys)
+
+        self.size -= 1
+        return entry[3]
+
+    def peek_time(self):
+        return self.buckets[self.keys[0]][0][0] if self.keys else math.inf
+
+    def __iter__(self):
+        return (entry[3] for entry in sorted(entry for bucket in self.buckets.values() for entry in bucket))
+
+
+SCHEDULERS = {"heap": HeapScheduler, "calendar": CalendarScheduler}
@@ -0,0 +1,135 @@
+"""
+Replicates a scenario with independent random seeds to estimate its indicators with confidence intervals. Every
+replica adds the fleet of the scenario to the same warm simulation, so the maps, the population and the passengers are
+shared by all of them, and draws the abilities of its drivers and its traffic delays from its own seed. Replicas run in
+batches of one per worker, and the replication stops early once the intervals of the watched indicators are narrow
+enough.
+
+Usage: python -m experiments.replications [replicas] [workers]
+"""
+import math
+import os
+import random
+import sys
+
+import numpy as np
+from numpy.random import SeedSequence
+
+from experiments.scenarios import Scenario, run_tasks, warm_simulation
+from simulation import END_TIME
+
+MIN_REPLICAS = 3
+WATCHED_KPIS = ("mean_waiting_time", "walking_trips", "impossible_plans")
+
+# 0.975 quantiles of the t distribution by degrees of freedom, for the 95% confidence intervals
+T_QUANTILES = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+               11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093,
+               20: 2.086, 21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060, 26: 2.056, 27: 2.052, 28: 2.048,
+               29: 2.045, 30: 2.042, 40: 2.021, 60: 2.000, 120: 1.980}
+NORMAL_QUANTILE = 1.960
+
+
+def t_quantile(degrees_of_freedom):
+    """
+    Returns:
+        float: the 0.975 quantile of the t distribution at the closest tabulated degrees of freedom below, which
+        widens the interval slightly between tabulated values.
+    """
+    if degrees_of_freedom > max(T_QUANTILES):
+        return NORMAL_QUANTILE
+
+    return T_QUANTILES[max(tabulated for tabulated in T_QUANTILES if tabulated <= degrees_of_freedom)]
+
+
+def confidence_interval(values):
+    """
+    95% confidence interval of the mean of the values, ignoring the nan ones.
+    Returns:
+        tuple[float, float, int]: the mean, the half width of the interval, infinite with fewer than two values,
+        and the amount of values used.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+
+    if len(values) == 0:
+        return float("nan"), math.inf, 0
+
+    if len(values) == 1:
+        return float(values[0]), math.inf, 1
+
+    half_width = t_quantile(len(values) - 1) * values.std(ddof=1) / math.sqrt(len(values))
+    return float(values.mean()), float(half_width), len(values)
+
+
+def summarize(results):
+    """
+    Returns:
+        dict[str, tuple[float, float, int]]: the confidence interval of every indicator of the replicas.
+    """
+    return {kpi: confidence_interval([kpis[kpi] for kpis in results]) for kpi in results[0]} if results else {}
+
+
+def replicate(simulation, scenario, replicas=30, seed=0, until=END_TIME, target_widths=None, workers=None):
+    """
+    Runs seeded replicas of the scenario from the current state of the simulation, which is left unchanged.
+    Args:
+        simulation (Simulation): simulation with its maps, population and passengers initialized.
+        scenario (Scenario): the scenario to replicate.
+        replicas (int): maximum amount of replicas.
+        seed (int): seed from which the seeds of the replicas are spawned.
+        until (float): minute of the day at which the replicas stop.
+        target_widths (dict[str, float]): maximum width of the interval of every watched indicator, the replication
+            stops once every one is met, after MIN_REPLICAS replicas. All the replicas run if None.
+        workers (int): amount of processes running replicas at the same time, all the cpus if None.
+    Returns:
+        tuple[dict[str, tuple[float, float, int]], list[dict[str, float]]]: the confidence intervals of the indicators
+        and the indicators of every replica.
+    """
+    seeds = [int(sequence.generate_state(1)[0]) for sequence in SeedSequence(seed).spawn(replicas)]
+    batch_size = workers or os.cpu_count() or 1
+
+    results = []
+    summary = {}
+
+    for start in range(0, replicas, batch_size):
+        tasks = [(scenario, until, random.Random(replica_seed).getstate())
+                 for replica_seed in seeds[start:start + batch_size]]
+        results += run_tasks(simulation, tasks, workers)
+        summary = summarize(results)
+
+        if target_widths and len(results) >= MIN_REPLICAS and all(
+                2 * summary[kpi][1] <= width for kpi, width in target_widths.items()):
+            break
+
+    return summary, results
+
+
+def format_summary(summary):
+    """
+    Returns:
+        str: the mean and the interval of every indicator as a text table.
+    """
+    def cell(value):
+        return f"{value:.2f}" if math.isfinite(value) else "-"
+
+    rows = [["indicator", "mean", "low", "high", "replicas"]]
+
+    for kpi, (mean, half_width, count) in summary.items():
+        rows.append([kpi, cell(mean), cell(mean - half_width), cell(mean + half_width), str(count)])
+
+    widths = [max(len(row[position]) for row in rows) for position in range(len(rows[0]))]
+
+    return "\n".join("  ".join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def main(replicas=30, workers=None):
+    simulation, refs = warm_simulation()
+
+    summary, _ = replicate(simulation, Scenario("1 bus per route", {ref: 1 for ref in refs}, 600), replicas,
+                           target_widths={kpi: 1.0 for kpi in WATCHED_KPIS}, workers=workers)
+
+    print(format_summary(summary))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,179 @@
+"""
+Compares what-if variants of a simulation that differ only in its bus fleet. The maps, the population and the
+passengers are initialized once, and every variant adds its drivers to a copy of that warm state and runs in its own
+process: a fork of the current process when available, otherwise the variants run one after the other restoring a
+snapshot of the warm state. Every variant continues from the same random state.
+
+The events of the runs are not recorded, their indicators are collected by the EventMetrics of the simulation.
+
+Usage: python -m experiments.scenarios [workers]
+"""
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+from simulation import Simulation, TIME_BETWEEN_DEPARTURES, END_TIME
+
+# simulation whose warm state is inherited by the forked scenario workers
+base_simulation = None
+
+
+@dataclass
+class Scenario:
+    name: str
+    bus_distributions: dict[str, int]
+    start_time: int
+    time_between_departures: int = TIME_BETWEEN_DEPARTURES
+
+
+def run_scenario(simulation, scenario, until):
+    """
+    Adds the fleet of the scenario to the simulation and runs it.
+    Returns:
+        dict[str, float]: the indicators of the run.
+    """
+    drivers, departure_times, environments, simulation.min_fuel_by_model = simulation.build_drivers(
+        scenario.bus_distributions, scenario.start_time, scenario.time_between_departures)
+    simulation.add_drivers(drivers, departure_times, environments)
+
+    simulation.run_until(until)
+
+    kpis = {"drivers": len(drivers)}
+    kpis.update(simulation.metrics.kpis())
+    kpis["waiting_at_end"] = len(simulation.stops.waiting)
+    kpis["riding_at_end"] = len(simulation.stops.riding)
+    return kpis
+
+
+def run_task(simulation, task):
+    scenario, until, random_state = task
+
+    random.setstate(random_state)
+    return run_scenario(simulation, scenario, until)
+
+
+def run_forked_task(task):
+    return run_task(base_simulation, task)
+
+
+def run_tasks(simulation, tasks, workers=None):
+    """
+    Runs every task from the current state of the simulation, which is left unchanged.
+    Args:
+        simulation (Simulation): simulation with its maps, population and passengers initialized.
+        tasks (list[tuple[Scenario, float, tuple]]): the scenario of every run, the minute of the day at which it
+            stops and the state of the random module it starts from.
+        workers (int): amount of processes running at the same time, all the cpus if None.
+    Returns:
+        list[dict[str, float]]: the indicators of every run.
+    """
+    global base_simulation
+
+    workers = workers or os.cpu_count() or 1
+    # the parameters of the drivers are asked here, the workers must not use the parameters provider
+    for scenario, _, _ in tasks:
+        simulation.resolve_minimum_fuel_levels(scenario.bus_distributions)
+
+    # the events of the scenarios are not recorded, the records of the warm simulation are written before forking
+    recording = simulation.recorder.sampling
+    simulation.recorder.flush()
+    simulation.recorder.sampling = 0
+
+    try:
+        if workers > 1 and len(tasks) > 1 and "fork" in multiprocessing.get_all_start_methods():
+            base_simulation = simulation
+
+            # a new worker is forked for every task, so none of them sees the state left by another one
+            with multiprocessing.get_context("fork").Pool(min(workers, len(tasks)), maxtasksperchild=1) as pool:
+                return pool.map(run_forked_task, tasks, chunksize=1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/warm_state.pkl"
+            simulation.snapshot(path)
+
+            results = []
+
+            for task in tasks:
+                try:
+                    results.append(run_task(simulation, task))
+                finally:
+                    simulation.restore(path)
+
+            return results
+    finally:
+        base_simulation = None
+        simulation.recorder.sampling = recording
+
+
+def compare_scenarios(simulation, scenarios, until=END_TIME, workers=None):
+    """
+    Runs every scenario from the current state of the simulation and of the random module.
+    Args:
+        simulation (Simulation): simulation with its maps, population and passengers initialized.
+        scenarios (list[Scenario]): the variants to run.
+        until (float): minute of the day at which the variants stop.
+        workers (int): amount of processes running variants at the same time, all the cpus if None.
+    Returns:
+        list[dict[str, float]]: the indicators of every scenario.
+    """
+    random_state = random.getstate()
+    return run_tasks(simulation, [(scenario, until, random_state) for scenario in scenarios], workers)
+
+
+def format_table(scenarios, results):
+    """
+    Returns:
+        str: the indicators of the scenarios as a text table, one row per scenario.
+    """
+    columns = list(results[0].keys()) if results else []
+
+    def cell(value):
+        if isinstance(value, float):
+            return "-" if math.isnan(value) else f"{value:.2f}"
+        return str(value)
+
+    rows = [["scenario"] + columns]
+    rows += [[scenario.name] + [cell(kpis[column]) for column in columns] for scenario, kpis in zip(scenarios, results)]
+
+    widths = [max(len(row[position]) for row in rows) for position in range(len(rows[0]))]
+
+    return "\n".join("  ".join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def warm_simulation():
+    """
+    Returns:
+        tuple[Simulation, list[str]]: the simulation of main without buses and the refs of the routes.
+    """
+    src_path = Path(__file__).parent.parent
+
+    with open(f"{src_path}/data/routes.json", 'r') as file:
+        refs = json.load(file)["routes"]
+
+    simulation = Simulation(f"{src_path}/map", f"{src_path}/population", 1827,
+                            f"{src_path}/data", {}, 600, ["playa"], seed=0)
+
+    return simulation, refs
+
+
+def main(workers=None):
+    simulation, refs = warm_simulation()
+
+    scenarios = [
+        Scenario("1 bus per route", {ref: 1 for ref in refs}, 600),
+        Scenario("2 buses per route", {ref: 2 for ref in refs}, 600),
+        Scenario("2 buses every 15 min", {ref: 2 for ref in refs}, 600, 15),
+        Scenario("3 buses every 15 min", {ref: 3 for ref in refs}, 600, 15),
+    ]
+
+    print(format_table(scenarios, compare_scenarios(simulation, scenarios, workers=workers)))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
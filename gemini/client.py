@@ -0,0 +1,269 @@
+import asyncio
+import bisect
+import os
+import threading
+import time
+
+# amount of requests in flight at the same time
+CONCURRENCY = 4
+# seconds a request may take before it is cancelled and retried
+TIMEOUT = 30
+# attempts of every request, waiting BACKOFF * 2 ** attempt seconds between them
+ATTEMPTS = 3
+BACKOFF = 0.5
+# seconds an answer is served from the cache
+CACHE_TTL = 3600
+
+# upper bounds in seconds of the buckets of the latency histograms, the last bucket has no bound
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+MODEL_NAME = 'gemini-pro'
+
+
+class GeminiBackend:
+    """
+    Generates the answers with a single Gemini model, configured on the first request with the API_KEY of the
+    environment and reused by every request.
+    """
+    name = "gemini"
+
+    def __init__(self, model_name=MODEL_NAME):
+        self.model_name = model_name
+        self.model = None
+
+    async def generate(self, prompt):
+        if self.model is None:
+            from dotenv import load_dotenv
+            import google.generativeai as genai
+
+            load_dotenv()
+            genai.configure(api_key=os.getenv("API_KEY"))
+            self.model = genai.GenerativeModel(self.model_name)
+
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+
+class FakeBackend:
+    """
+    Local backend without network, for tests and offline runs.
+    """
+    name = "fake"
+
+    def __init__(self, answer=None, delay=0.0):
+        """
+        Args:
+            answer (Callable[[str], str] | dict[str, str] | None): answer of every prompt, "0" for unknown prompts.
+            delay (float): seconds every answer takes.
+        """
+        self.answer = answer
+        self.delay = delay
+        self.prompts = []
+
+    async def generate(self, prompt):
+        self.prompts.append(prompt)
+
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        if callable(self.answer):
+            return self.answer(prompt)
+
+        return (self.answer or {}).get(prompt, "0")
+
+
+BACKENDS = {backend.name: backend for backend in (GeminiBackend, FakeBackend)}
+
+
+class LatencyHistogram:
+    """
+    Counts of the latencies of the requests by bucket.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += seconds
+
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """
+        Returns:
+            float: upper bound of the bucket holding the quantile q of the latencies, inf if it is the last bucket and
+            nan without latencies.
+        """
+        count = self.count()
+        if count == 0:
+            return float("nan")
+
+        accumulated = 0
+        for bound, bucket_count in zip(self.bounds + (float("inf"),), self.counts):
+            accumulated += bucket_count
+            if accumulated >= q * count:
+                return bound
+
+    def summary(self):
+        count = self.count()
+        return {
+            "count": count,
+            "mean": self.total / count if count else float("nan"),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class LLMClient:
+    """
+    Asynchronous client of a language model backend, gemini by default or the one named by the LLM_BACKEND environment
+    variable.
+
+    Requests run in an event loop of their own thread, so callers from any thread only wait for their own answer and
+    the interpreter stays free for the simulation meanwhile. At most `concurrency` requests are in flight, identical
+    prompts in flight are sent once, answers are cached for `ttl` seconds, and every attempt has a timeout and is
+    retried with exponential backoff.
+    """
+
+    def __init__(self, backend=None, concurrency=CONCURRENCY, timeout=TIMEOUT, attempts=ATTEMPTS, backoff=BACKOFF,
+                 ttl=CACHE_TTL):
+        """
+        Args:
+            backend: backend or name of the backend.
+            concurrency (int): amount of requests in flight at the same time.
+            timeout (float): seconds an attempt may take.
+            attempts (int): attempts of every request.
+            backoff (float): seconds waited before the first retry, doubled on every retry.
+            ttl (float): seconds an answer is served from the cache.
+        """
+        backend = backend or os.getenv("LLM_BACKEND", GeminiBackend.name)
+        self.backend = BACKENDS[backend]() if isinstance(backend, str) else backend
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.attempts = attempts
+        self.backoff = backoff
+        self.ttl = ttl
+
+        # prompt -> (expiration time, answer)
+        self.cache = {}
+        # prompt -> future of the request in flight
+        self.in_flight = {}
+        self.latencies = LatencyHistogram()
+        self.attempt_latencies = LatencyHistogram()
+        self.failures = 0
+
+        self.loop = None
+        self.semaphore = None
+        self.start_lock = threading.Lock()
+
+        # the thread of the event loop does not exist in forked processes, they start their own
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.loop = None
+        self.semaphore = None
+        self.in_flight = {}
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        with self.start_lock:
+            if self.loop is not None:
+                return
+
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.loop.run_forever, name="llm-client", daemon=True).start()
+
+    def close(self):
+        with self.start_lock:
+            if self.loop is None:
+                return
+
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop = None
+            self.semaphore = None
+
+    def generate(self, prompt):
+        """
+        Blocks the calling thread until the answer of the prompt is available.
+        Returns:
+            str: the answer.
+        Raises:
+            ConnectionError: if every attempt failed or timed out.
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self.generate_async(prompt), self.loop).result()
+
+    def generate_many(self, prompts):
+        """
+        Returns:
+            list[str]: the answer of every prompt, asked concurrently.
+        """
+        self.start()
+
+        async def generate_all():
+            return await asyncio.gather(*(self.generate_async(prompt) for prompt in prompts))
+
+        return asyncio.run_coroutine_threadsafe(generate_all(), self.loop).result()
+
+    async def generate_async(self, prompt):
+        """
+        Must run in the event loop of the client.
+        """
+        cached = self.cache.get(prompt)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        future = self.in_flight.get(prompt)
+        if future is None:
+            future = asyncio.ensure_future(self.request(prompt))
+            self.in_flight[prompt] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(prompt, None))
+
+        # the request is shared by every caller of the prompt, so a cancelled caller does not cancel it
+        return await asyncio.shield(future)
+
+    async def request(self, prompt):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        start = time.monotonic()
+        error = None
+
+        for attempt in range(self.attempts):
+            if attempt > 0:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+            async with self.semaphore:
+                attempt_start = time.monotonic()
+                try:
+                    answer = await asyncio.wait_for(self.backend.generate(prompt), self.timeout)
+                except Exception as exception:
+                    error = exception
+                    continue
+                finally:
+                    self.attempt_latencies.record(time.monotonic() - attempt_start)
+
+            now = time.monotonic()
+            self.latencies.record(now - start)
+            self.cache[prompt] = (now + self.ttl, answer)
+            return answer
+
+        self.failures += 1
+        raise ConnectionError(f"The {self.backend.name} backend failed {self.attempts} times") from error
+
+    def stats(self):
+        """
+        Returns:
+            dict: latencies of the answered requests and of every attempt, and amount of failed requests.
+        """
+        return {
+            "requests": self.latencies.summary(),
+            "attempts": self.attempt_latencies.summary(),
+            "failures": self.failures,
+            "cached": len(self.cache),
+        }
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import threading
+from pathlib import Path
+
+# amount of backend requests in flight at the same time
+CONCURRENCY = 8
+
+# walking speed in kilometers per hour by age range, used by the offline backend
+WALK_SPEEDS = {
+    '15-19': 5,
+    '20-24': 5,
+    '25-39': 5,
+    '40-54': 5,
+    '55-64': 4,
+    '65+': 3
+}
+DEFAULT_WALK_SPEED = 5
+
+# fraction of the tank below which a bus goes to refuel, used by the offline backend
+MINIMUM_FUEL_FRACTION = 0.2
+
+
+class GeminiBackend:
+    """
+    Asks the parameters to Gemini through gemini.llm, imported on the first request so that neither the model nor its
+    credentials are needed when every parameter is cached.
+    """
+    name = "gemini"
+
+    @staticmethod
+    def walk_speed(employment_status, student_type, age):
+        from gemini import llm
+        return llm.walk_speed(employment_status, student_type, age)
+
+    @staticmethod
+    def minimum_fuel_level(bus_model, max_fuel):
+        from gemini import llm
+        return llm.minimum_fuel_level(bus_model, max_fuel)
+
+
+class OfflineBackend:
+    """
+    Answers the parameters from fixed tables, without network.
+    """
+    name = "offline"
+
+    @staticmethod
+    def walk_speed(employment_status, student_type, age):
+        return WALK_SPEEDS.get(age, DEFAULT_WALK_SPEED)
+
+    @staticmethod
+    def minimum_fuel_level(bus_model, max_fuel):
+        return int(max_fuel * MINIMUM_FUEL_FRACTION)
+
+
+BACKENDS = {backend.name: backend for backend in (GeminiBackend, OfflineBackend)}
+
+
+class ParameterProvider:
+    """
+    Parameters of the agents asked to a backend, gemini by default or the one named by the PARAMETERS_BACKEND
+    environment variable. Answers are cached by backend, parameter and arguments in a json file, so every distinct
+    question is only asked once. Questions missing from the cache are deduplicated and asked concurrently.
+
+    Answers that are not valid (None) are only cached in memory, so they are asked again in the next session. Answers
+    of forked processes are only cached in their memory too, so they never race to write the file.
+    """
+
+    def __init__(self, cache_path=None, backend=None, concurrency=CONCURRENCY):
+        """
+        Args:
+            cache_path: json file of the cache, the cache is only kept in memory if None.
+            backend: backend or name of the backend.
+            concurrency (int): amount of backend requests in flight at the same time.
+        """
+        backend = backend or os.getenv("PARAMETERS_BACKEND", GeminiBackend.name)
+        self.backend = BACKENDS[backend] if isinstance(backend, str) else backend
+        self.concurrency = concurrency
+        self.cache_path = Path(cache_path) if cache_path is not None else None
+        self.lock = threading.Lock()
+        # only the process that created the provider writes the cache file, forked processes keep their answers
+        self.owner = os.getpid()
+        os.register_at_fork(after_in_child=self.reset_lock)
+
+        self.saved = {}
+        if self.cache_path is not None and self.cache_path.exists():
+            self.saved = json.loads(self.cache_path.read_text())
+
+        self.cache = {}
+        for parameter, answers in self.saved.get(self.backend.name, {}).items():
+            for arguments, value in answers.items():
+                self.cache[(parameter, *json.loads(arguments))] = value
+
+    def reset_lock(self):
+        self.lock = threading.Lock()
+
+    def walk_speed(self, employment_status, student_type, age):
+        return self.get("walk_speed", employment_status, student_type, age)
+
+    def minimum_fuel_level(self, bus_model, max_fuel):
+        return self.get("minimum_fuel_level", bus_model, max_fuel)
+
+    def get(self, parameter, *arguments):
+        return self.get_many([(parameter, *arguments)])[0]
+
+    def get_many(self, requests):
+        """
+        Args:
+            requests (list[tuple]): the name of the parameter followed by its arguments, for every request.
+        Returns:
+            list: the value of every request.
+        """
+        requests = [tuple(request) for request in requests]
+
+        with self.lock:
+            misses = list(dict.fromkeys(request for request in requests if request not in self.cache))
+
+            if misses:
+                values = asyncio.run(self.ask(misses))
+                self.cache.update(zip(misses, values))
+                self.save(request for request, value in zip(misses, values) if value is not None)
+
+            return [self.cache[request] for request in requests]
+
+    async def ask(self, requests):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def ask_one(parameter, *arguments):
+            async with semaphore:
+                return await asyncio.to_thread(getattr(self.backend, parameter), *arguments)
+
+        return await asyncio.gather(*(ask_one(*request) for request in requests))
+
+    def save(self, requests):
+        answers = self.saved.setdefault(self.backend.name, {})
+        changed = False
+
+        for parameter, *arguments in requests:
+            answers.setdefault(parameter, {})[json.dumps(arguments)] = self.cache[(parameter, *arguments)]
+            changed = True
+
+        if not changed or self.cache_path is None or os.getpid() != self.owner:
+            return
+
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.cache_path.with_suffix(".tmp")
+        temporary_path.write_text(json.dumps(self.saved, indent=2, sort_keys=True))
+        os.replace(temporary_path, self.cache_path)
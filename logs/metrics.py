@@ -0,0 +1,72 @@
+import numpy as np
+
+from events.event import EventType
+
+
+class EventMetrics:
+    """
+    Indicators of a run accumulated while its events are dispatched, so they are available without parsing the logs.
+    Agents are identified by their index in the simulation.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.waiting_times = []
+        self.boardings_per_driver = {}
+        self.walking_trips = 0
+
+        # passenger index -> time of its last AT_STOP event
+        self.stop_arrivals = {}
+        # passengers that boarded a bus since their last departure
+        self.riders = set()
+
+    def record(self, event, environment):
+        """
+        Args:
+            event (Event): the dispatched event.
+            environment: environment of the agent of the event.
+        """
+        event_type = event.event_type
+        agent_index = event.agent_index
+
+        self.counts[event_type] = self.counts.get(event_type, 0) + 1
+
+        if event_type == EventType.AT_STOP:
+            self.stop_arrivals[agent_index] = event.time
+
+        elif event_type == EventType.BOARD_VEHICLE:
+            arrival = self.stop_arrivals.pop(agent_index, None)
+            if arrival is not None:
+                self.waiting_times.append(event.time - arrival)
+
+            self.riders.add(agent_index)
+            driver = environment.current_driver
+            self.boardings_per_driver[driver] = self.boardings_per_driver.get(driver, 0) + 1
+
+        elif event_type == EventType.AT_GOAL:
+            if agent_index not in self.riders:
+                self.walking_trips += 1
+            self.riders.discard(agent_index)
+
+        elif event_type == EventType.DEPARTURE:
+            self.riders.discard(agent_index)
+
+    def kpis(self):
+        """
+        Returns:
+            dict[str, float]: the indicators of the run.
+        """
+        waiting_times = np.array(self.waiting_times, dtype=float)
+        has_waits = len(waiting_times) > 0
+
+        return {
+            "events": sum(self.counts.values()),
+            "trips": self.counts.get(EventType.AT_GOAL, 0),
+            "walking_trips": self.walking_trips,
+            "impossible_plans": self.counts.get(EventType.IMPOSSIBLE_PLAN, 0),
+            "boardings": self.counts.get(EventType.BOARD_VEHICLE, 0),
+            "buses_used": len(self.boardings_per_driver),
+            "mean_waiting_time": float(waiting_times.mean()) if has_waits else float("nan"),
+            "p90_waiting_time": float(np.percentile(waiting_times, 90)) if has_waits else float("nan"),
+            "max_waiting_time": float(waiting_times.max()) if has_waits else float("nan"),
+        }
@@ -0,0 +1,182 @@
+import atexit
+import os
+import queue
+import threading
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+# record of a dispatched event, agents and drivers are identified by their index in the simulation
+RECORD_DTYPE = np.dtype([("time", np.float64), ("event_type", np.uint8), ("agent", np.int32), ("driver", np.int32)])
+
+# driver of the records of drivers, passengers that are not on a vehicle are recorded with NO_DRIVER
+DRIVER_AGENT_RECORD = -2
+
+# records buffered before they are handed to the writer thread
+CHUNK_SIZE = 1 << 16
+
+# bytes of the .npy header of the record files, large enough for any amount of records so it is rewritten in place
+HEADER_SIZE = 256
+
+
+class EventRecorder:
+    """
+    Binary log of the dispatched events. Records are written into a preallocated buffer and every full buffer is
+    appended to the file by a background thread, so the simulation never formats nor writes them. The file is a .npy
+    array of RECORD_DTYPE records whose header is updated after every chunk, read back with np.load or load_records.
+
+    The writer thread is a daemon so it never keeps the process alive, close joins it after writing every record and
+    is also called at exit. Recording, flushing and closing hold a lock, so closing from another thread, as at exit,
+    never hands over a buffer that is still being written nor loses the records of the active run.
+    """
+
+    def __init__(self, path, sampling=1, chunk_size=CHUNK_SIZE):
+        """
+        Args:
+            path: .npy file the records are appended to, created on the first write.
+            sampling (int): only the events of one of every `sampling` agents are recorded, so the sampled agents keep
+                their whole history. Recording is disabled if 0.
+            chunk_size (int): records buffered before they are written.
+        """
+        self.path = path
+        self.sampling = sampling
+        self.chunk_size = chunk_size
+
+        self.buffer = np.empty(chunk_size, dtype=RECORD_DTYPE)
+        self.size = 0
+        self.recorded = 0
+
+        # buffers already written, reused instead of allocating new ones
+        self.free_buffers = queue.SimpleQueue()
+        self.pending = queue.Queue()
+        self.writer = None
+        self.lock = threading.Lock()
+
+        atexit.register(self.close)
+
+    @property
+    def enabled(self):
+        return self.sampling > 0
+
+    def record(self, time, event_type, agent, driver):
+        """
+        Args:
+            time (float): time of the event.
+            event_type (int): value of the EventType of the event.
+            agent (int): index of the agent of the event.
+            driver (int): index of the driver carrying the passenger, NO_DRIVER or DRIVER_AGENT_RECORD.
+        """
+        if self.sampling != 1 and (self.sampling == 0 or agent % self.sampling):
+            return
+
+        with self.lock:
+            self.buffer[self.size] = (time, event_type, agent, driver)
+            self.size += 1
+
+            if self.size == self.chunk_size:
+                self.hand_over()
+
+    def flush(self):
+        """
+        Hands the buffered records to the writer thread.
+        """
+        with self.lock:
+            self.hand_over()
+
+    def hand_over(self):
+        """
+        Must be called holding the lock.
+        """
+        if self.size == 0:
+            return
+
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write, name="event-recorder", daemon=True)
+            self.writer.start()
+
+        self.pending.put((self.buffer, self.size))
+        self.recorded += self.size
+
+        try:
+            self.buffer = self.free_buffers.get_nowait()
+        except queue.Empty:
+            self.buffer = np.empty(self.chunk_size, dtype=RECORD_DTYPE)
+
+        self.size = 0
+
+    def write(self):
+        mode = "r+b" if os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER_SIZE else "w+b"
+
+        with open(self.path, mode) as file:
+            count = record_count(file) if mode == "r+b" else 0
+            file.seek(HEADER_SIZE + count * RECORD_DTYPE.itemsize)
+
+            while True:
+                buffer, size = self.pending.get()
+
+                if buffer is None:
+                    self.pending.task_done()
+                    return
+
+                buffer[:size].tofile(file)
+                count += size
+
+                file.seek(0)
+                file.write(npy_header(count))
+                file.seek(0, os.SEEK_END)
+                file.flush()
+
+                self.free_buffers.put(buffer)
+                self.pending.task_done()
+
+    def wait(self):
+        """
+        Flushes the buffered records and waits until every record is in the file.
+        """
+        self.flush()
+
+        if self.writer is not None:
+            self.pending.join()
+
+    def close(self):
+        """
+        Writes every buffered record and stops the writer thread, a later record starts a new one that keeps
+        appending to the file.
+        """
+        with self.lock:
+            self.hand_over()
+
+            if self.writer is not None:
+                self.pending.put((None, 0))
+                self.writer.join()
+                self.writer = None
+
+
+def npy_header(count):
+    """
+    Returns:
+        bytes: the .npy 1.0 header of an array of count records, padded to HEADER_SIZE bytes.
+    """
+    header = repr({"descr": npy_format.dtype_to_descr(RECORD_DTYPE), "fortran_order": False, "shape": (count,)})
+    header = header.encode("latin1").ljust(HEADER_SIZE - 10 - 1) + b"\n"
+    return npy_format.magic(1, 0) + len(header).to_bytes(2, "little") + header
+
+
+def record_count(file):
+    """
+    Returns:
+        int: amount of complete records in the file, which may be more than its header says if the process died
+        before updating it.
+    """
+    size = os.fstat(file.fileno()).st_size
+    return (size - HEADER_SIZE) // RECORD_DTYPE.itemsize
+
+
+def load_records(path):
+    """
+    Returns:
+        np.ndarray: the RECORD_DTYPE records of the file, in order of dispatch, including the ones written after the
+        last update of the header.
+    """
+    with open(path, "rb") as file:
+        return np.fromfile(file, dtype=RECORD_DTYPE, count=record_count(file), offset=HEADER_SIZE)
@@ -19,28 +19,33 @@ def chat(simulation: Simulation, actions: list):
     while True:
         entry = input()
 
-        response = llm.chat(entry, actions)
-
-        if response == "Iniciar simulación":
-            print("La simulación ha empezado. Por favor, espera unos minutos.")
-            threading.Thread(target=simulation.run).start()
-        elif response == "Detener simulación":
-            print("La simulación se detuvo.")
-            simulation.stop()
-        elif response == "Planes imposibles":
-            llm.answer_chat(entry, None)
-        elif response == "Caminando":
-            llm.answer_chat(entry, None)
-        elif response == "Máximo tiempo de espera":
-            llm.answer_chat(entry, None)
-        elif response == "Mínimo tiempo de espera":
-            llm.answer_chat(entry, None)
-        elif response == "Tiempo promedio de espera":
-            llm.answer_chat(entry, None)
-        elif response == "Pasajeros en una ruta":
-            llm.answer_chat(entry, None)
-        else:
-            print("Acción no reconocida.")
+        # the answers of the model can fail as well as the choice of the action, the chat keeps running
+        try:
+            response = llm.chat(entry, actions)
+
+            if response == "Iniciar simulación":
+                print("La simulación ha empezado. Por favor, espera unos minutos.")
+                threading.Thread(target=simulation.run).start()
+            elif response == "Detener simulación":
+                simulation.stop()
+                print(f"La simulación se detuvo en el minuto {simulation.time:.0f} tras {simulation.processed_events} "
+                      f"eventos. Iníciala de nuevo para continuar.")
+            elif response == "Planes imposibles":
+                llm.answer_chat(entry, None)
+            elif response == "Caminando":
+                llm.answer_chat(entry, None)
+            elif response == "Máximo tiempo de espera":
+                llm.answer_chat(entry, None)
+            elif response == "Mínimo tiempo de espera":
+                llm.answer_chat(entry, None)
+            elif response == "Tiempo promedio de espera":
+                llm.answer_chat(entry, None)
+            elif response == "Pasajeros en una ruta":
+                llm.answer_chat(entry, None)
+            else:
+                print("Acción no reconocida.")
+        except ConnectionError:
+            print("No se pudo contactar al modelo, inténtalo de nuevo.")
             
 
 
@@ -0,0 +1,216 @@
+import hashlib
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+
+from map import distance
+
+
+@dataclass(frozen=True)
+class CompactGraph:
+    """
+    Frozen, integer indexed view of a Graph. Block i has its outgoing edges stored in
+    targets[offsets[i]:offsets[i + 1]] (CSR adjacency), and every per block attribute is kept in a contiguous array.
+    """
+    ids: list[str]
+    index: dict[str, int]
+    offsets: np.ndarray
+    targets: np.ndarray
+    walk: np.ndarray
+    length: np.ndarray
+    speed: np.ndarray
+    traffic_signs: np.ndarray
+    stops: np.ndarray
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+
+    @staticmethod
+    def from_graph(graph):
+        """
+        Builds the compact view of a graph.
+        Args:
+            graph (Graph): the graph to compact.
+        Returns:
+            CompactGraph: the compact view of the graph.
+        """
+        ids = list(graph.nodes.keys())
+        index = {node_id: position for position, node_id in enumerate(ids)}
+        blocks = list(graph.nodes.values())
+        count = len(ids)
+
+        offsets = np.zeros(count + 1, dtype=np.int32)
+        targets = []
+        walk = []
+
+        for position, node_id in enumerate(ids):
+            for neighbor_id, walk_value in graph.edges.get(node_id, ()):
+                if neighbor_id not in index:
+                    continue
+
+                targets.append(index[neighbor_id])
+                walk.append(walk_value)
+
+            offsets[position + 1] = len(targets)
+
+        return CompactGraph(
+            ids=ids,
+            index=index,
+            offsets=offsets,
+            targets=np.array(targets, dtype=np.int32),
+            walk=np.array(walk, dtype=np.bool_),
+            length=np.fromiter((block.length for block in blocks), dtype=np.float64, count=count),
+            speed=np.fromiter((int(block.max_speed) for block in blocks), dtype=np.float64, count=count),
+            traffic_signs=np.fromiter((sum(1 for element in block.elements if element.is_traffic_sign)
+                                       for block in blocks), dtype=np.int32, count=count),
+            stops=np.fromiter((block.contains_stop() for block in blocks), dtype=np.bool_, count=count),
+            latitudes=np.fromiter((block.location.latitude for block in blocks), dtype=np.float64, count=count),
+            longitudes=np.fromiter((block.location.longitude for block in blocks), dtype=np.float64, count=count)
+        )
+
+    @property
+    def count(self):
+        return len(self.ids)
+
+    @cached_property
+    def fingerprint(self):
+        """
+        Hash of the blocks, their attributes and the CSR structure, equal for compact views of the same graph.
+        """
+        digest = hashlib.sha256("\0".join(self.ids).encode())
+
+        for array in (self.offsets, self.targets, self.walk, self.length, self.speed, self.traffic_signs, self.stops,
+                      self.latitudes, self.longitudes):
+            digest.update(np.ascontiguousarray(array).tobytes())
+
+        return digest.hexdigest()
+
+    def neighbors(self, position):
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.targets[start:end], self.walk[start:end]
+
+    @cached_property
+    def sources(self):
+        return np.repeat(np.arange(self.count, dtype=np.int32), np.diff(self.offsets))
+
+    @cached_property
+    def edge_lengths(self):
+        """
+        Distance in kilometers between the locations of the two blocks of every edge.
+        """
+        return distance.lengths_between(self.latitudes[self.sources], self.longitudes[self.sources],
+                                        self.latitudes[self.targets], self.longitudes[self.targets])
+
+    @cached_property
+    def adjacency(self):
+        """
+        Outgoing edges of every block as python tuples of (target, walk, length between locations), meant for the
+        pure python search loops where indexing numpy arrays one element at a time is slow.
+        """
+        targets = self.targets.tolist()
+        walk = self.walk.tolist()
+        edge_lengths = self.edge_lengths.tolist()
+        offsets = self.offsets.tolist()
+
+        return [tuple(zip(targets[offsets[position]:offsets[position + 1]],
+                          walk[offsets[position]:offsets[position + 1]],
+                          edge_lengths[offsets[position]:offsets[position + 1]]))
+                for position in range(self.count)]
+
+    @cached_property
+    def points(self):
+        return list(zip(self.latitudes.tolist(), self.longitudes.tolist()))
+
+
+@dataclass(frozen=True)
+class EdgeWeights:
+    """
+    Cost of leaving every block of a CompactGraph, either driving or walking, computed once for a given obstacle
+    penalty and walking speed.
+    """
+    compact: CompactGraph
+    obstacle_penalty: float
+    walk_speed: float
+    drive: np.ndarray
+    walk: np.ndarray
+    base: "EdgeWeights | None" = None
+    min_factor: float = 1.0
+
+    @staticmethod
+    def from_compact(compact, obstacle_penalty, walk_speed):
+        penalty = compact.traffic_signs * obstacle_penalty
+
+        return EdgeWeights(
+            compact=compact,
+            obstacle_penalty=obstacle_penalty,
+            walk_speed=walk_speed,
+            drive=compact.length / compact.speed + penalty,
+            walk=compact.length / walk_speed + penalty
+        )
+
+    def perturbed(self, factors):
+        """
+        Returns a copy of the weights with the cost of every block multiplied by its factor. The copy remembers the
+        unperturbed weights and the smallest factor, so lower bounds of the original costs can be scaled to stay
+        admissible.
+        """
+        base = self.base or self
+
+        return EdgeWeights(
+            compact=self.compact,
+            obstacle_penalty=self.obstacle_penalty,
+            walk_speed=self.walk_speed,
+            drive=base.drive * factors,
+            walk=base.walk * factors,
+            base=base,
+            min_factor=float(min(factors.min(), 1.0)) if len(factors) else 1.0
+        )
+
+    @cached_property
+    def edge_costs(self):
+        """
+        Cost of every CSR edge, taken from the walk or drive weight of its source block according to the edge flag.
+        """
+        sources = self.compact.sources
+        return np.where(self.compact.walk, self.walk[sources], self.drive[sources])
+
+    @cached_property
+    def fingerprint(self):
+        """
+        Hash of the blocks, the CSR structure and the edge costs, equal for weights of the same graph and costs.
+        """
+        digest = hashlib.sha256("\0".join(self.compact.ids).encode())
+
+        for array, dtype in ((self.compact.offsets, np.int64), (self.compact.targets, np.int64),
+                             (self.compact.walk, np.bool_), (self.edge_costs, np.float64)):
+            digest.update(np.ascontiguousarray(array, dtype=dtype).tobytes())
+
+        return digest.hexdigest()
+
+    @cached_property
+    def adjacency(self):
+        """
+        Outgoing edges of every block as python tuples of (target, walk, cost).
+        """
+        offsets = self.compact.offsets.tolist()
+        targets = self.compact.targets.tolist()
+        walk = self.compact.walk.tolist()
+        edge_costs = self.edge_costs.tolist()
+
+        return [tuple(zip(targets[offsets[position]:offsets[position + 1]],
+                          walk[offsets[position]:offsets[position + 1]],
+                          edge_costs[offsets[position]:offsets[position + 1]]))
+                for position in range(self.compact.count)]
+
+    @cached_property
+    def reverse_adjacency(self):
+        """
+        Incoming edges of every block as python tuples of (source, walk, cost).
+        """
+        reverse_adjacency = [[] for _ in range(self.compact.count)]
+
+        for position, edges in enumerate(self.adjacency):
+            for target, walk, cost in edges:
+                reverse_adjacency[target].append((position, walk, cost))
+
+        return [tuple(edges) for edges in reverse_adjacency]
@@ -0,0 +1,131 @@
+import math
+
+import numpy as np
+from geopy import distance
+
+EARTH_RADIUS = 6371.0088
+
+GEODESIC = "geodesic"
+HAVERSINE = "haversine"
+EQUIRECTANGULAR = "equirectangular"
+
+# the saved maps were built with geodesic distances, the faster modes are opt-in and rebuild them
+DISTANCE_MODE = GEODESIC
+
+
+def set_distance_mode(mode):
+    """
+    Selects the accuracy mode used by every distance computed on the map.
+    Args:
+        mode (str): one of "geodesic" (exact, slowest, default), "haversine" (spherical earth) or
+            "equirectangular" (flat projection, fastest and accurate at city scale).
+    """
+    global DISTANCE_MODE
+
+    if mode not in (GEODESIC, HAVERSINE, EQUIRECTANGULAR):
+        raise ValueError(f"Unknown distance mode {mode}")
+
+    DISTANCE_MODE = mode
+
+
+def length(latitude, longitude, other_latitude, other_longitude):
+    """
+    Computes the distance in kilometers between two points using the current distance mode.
+    """
+    if DISTANCE_MODE == HAVERSINE:
+        return haversine(latitude, longitude, other_latitude, other_longitude)
+
+    if DISTANCE_MODE == EQUIRECTANGULAR:
+        return equirectangular(latitude, longitude, other_latitude, other_longitude)
+
+    return distance.distance((latitude, longitude), (other_latitude, other_longitude)).kilometers
+
+
+def lengths(latitude, longitude, latitudes, longitudes):
+    """
+    Computes the distances in kilometers from one point to many points in a single vectorized call.
+    Args:
+        latitude (float): latitude of the origin.
+        longitude (float): longitude of the origin.
+        latitudes (np.ndarray): latitudes of the targets.
+        longitudes (np.ndarray): longitudes of the targets.
+    Returns:
+        np.ndarray: the distance to every target.
+    """
+    if DISTANCE_MODE == HAVERSINE:
+        return haversine_many(latitude, longitude, latitudes, longitudes)
+
+    if DISTANCE_MODE == EQUIRECTANGULAR:
+        return equirectangular_many(latitude, longitude, latitudes, longitudes)
+
+    return np.array([distance.distance((latitude, longitude), (other_latitude, other_longitude)).kilometers
+                     for other_latitude, other_longitude in zip(latitudes, longitudes)], dtype=np.float64)
+
+
+def haversine(latitude, longitude, other_latitude, other_longitude):
+    phi = math.radians(latitude)
+    other_phi = math.radians(other_latitude)
+    half_delta_phi = (other_phi - phi) / 2
+    half_delta_lambda = math.radians(other_longitude - longitude) / 2
+
+    a = math.sin(half_delta_phi) ** 2 + math.cos(phi) * math.cos(other_phi) * math.sin(half_delta_lambda) ** 2
+
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def haversine_many(latitude, longitude, latitudes, longitudes):
+    phi = math.radians(latitude)
+    other_phi = np.radians(latitudes)
+    half_delta_phi = (other_phi - phi) / 2
+    half_delta_lambda = np.radians(np.asarray(longitudes) - longitude) / 2
+
+    a = np.sin(half_delta_phi) ** 2 + math.cos(phi) * np.cos(other_phi) * np.sin(half_delta_lambda) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def equirectangular(latitude, longitude, other_latitude, other_longitude):
+    x = math.radians(other_longitude - longitude) * math.cos(math.radians((latitude + other_latitude) / 2))
+    y = math.radians(other_latitude - latitude)
+
+    return EARTH_RADIUS * math.hypot(x, y)
+
+
+def equirectangular_many(latitude, longitude, latitudes, longitudes):
+    latitudes = np.asarray(latitudes)
+    x = np.radians(np.asarray(longitudes) - longitude) * np.cos(np.radians((latitudes + latitude) / 2))
+    y = np.radians(latitudes - latitude)
+
+    return EARTH_RADIUS * np.hypot(x, y)
+
+
+def nearest_length(latitude, longitude, latitudes, longitudes):
+    """
+    Computes the distance in kilometers from one point to the closest of many points, taking the scalar path when
+    there is a single target.
+    """
+    if len(latitudes) == 1:
+        return length(latitude, longitude, float(latitudes[0]), float(longitudes[0]))
+
+    return float(lengths(latitude, longitude, latitudes, longitudes).min())
+
+
+def lengths_between(latitudes, longitudes, other_latitudes, other_longitudes):
+    """
+    Computes the element-wise distances in kilometers between two sequences of points.
+    """
+    if DISTANCE_MODE == GEODESIC:
+        return np.array([distance.distance(point, other_point).kilometers
+                         for point, other_point in zip(zip(latitudes, longitudes),
+                                                       zip(other_latitudes, other_longitudes))], dtype=np.float64)
+
+    phi = np.radians(latitudes)
+    other_phi = np.radians(other_latitudes)
+    delta_lambda = np.radians(np.asarray(other_longitudes) - np.asarray(longitudes))
+
+    if DISTANCE_MODE == EQUIRECTANGULAR:
+        return EARTH_RADIUS * np.hypot(delta_lambda * np.cos((phi + other_phi) / 2), other_phi - phi)
+
+    a = np.sin((other_phi - phi) / 2) ** 2 + np.cos(phi) * np.cos(other_phi) * np.sin(delta_lambda / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
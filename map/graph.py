@@ -1,6 +1,6 @@
 import heapq
 
-from map.map_elements import Node
+from map.compact_graph import CompactGraph, EdgeWeights
 
 
 class Graph:
@@ -16,12 +16,23 @@ class Graph:
         self.is_simplified = False
         self.nodes_by_municipality = {}
         self.places_of_interest = {}
+        self.compact_graph = None
+        self.weights = None
+        self.landmarks = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["compact_graph"] = None
+        state["weights"] = None
+        state["landmarks"] = None
+        return state
 
     def add_node(self, node):
 
         if node.id not in self.nodes:
             self.nodes[node.id] = node
             self.count += 1
+            self.invalidate()
         else:
             raise Exception("Node already exists")
 
@@ -31,6 +42,46 @@ class Graph:
         else:
             self.edges[src].add((dest, walk))
 
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Drops the compact view of the graph and its edge weights, it must be called whenever blocks or edges are
+        modified in place.
+        """
+        self.compact_graph = None
+        self.weights = None
+
+    def compact(self):
+        """
+        Returns the integer indexed CSR view of the graph, building it on first use.
+        """
+
+        if getattr(self, "compact_graph", None) is None:
+            self.compact_graph = CompactGraph.from_graph(self)
+
+        return self.compact_graph
+
+    def edge_weights(self, obstacle_penalty, walk_speed):
+        """
+        Returns the drive and walk cost of every block, computing them on first use or when the parameters change.
+        """
+        weights = getattr(self, "weights", None)
+
+        if (weights is None or weights.compact is not self.compact() or weights.obstacle_penalty != obstacle_penalty
+                or weights.walk_speed != walk_speed):
+            self.weights = EdgeWeights.from_compact(self.compact(), obstacle_penalty, walk_speed)
+
+        return self.weights
+
+    def locations(self):
+        """
+        Returns the position of every block id along with the latitudes and longitudes of all the blocks stored in
+        contiguous arrays, so distances to many blocks can be computed in one vectorized call.
+        """
+        compact = self.compact()
+        return compact.index, compact.latitudes, compact.longitudes
+
     def is_connected(self, src, dest, walk=False):
 
         if walk:
@@ -64,39 +115,44 @@ class Graph:
 
     def simplify(self, radio):
         simplified_graph = Graph()
+        compact = self.compact()
 
-        simplified_nodes = {node.id: node for node in self.nodes.values() if node.contains_stop()}
+        adjacency = compact.adjacency
+        lengths = compact.length.tolist()
+        stops = compact.stops.tolist()
 
-        length_to_start = {key: 0 for key in simplified_nodes.keys()}
+        length_to_start = {position: 0 for position in range(compact.count) if stops[position]}
         sum_length = 0
 
         open_set = []
+        counter = 0
 
-        for node in simplified_nodes.values():
-            heapq.heappush(open_set, Node(node.id, g_score=node.length, f_score=0))
+        for position in length_to_start.keys():
+            heapq.heappush(open_set, (0, counter, position, lengths[position]))
+            counter += 1
 
         while open_set:
 
-            current_node = heapq.heappop(open_set)
-            if current_node.id not in simplified_graph.nodes:
-                current_block = self.nodes[current_node.id]
-                simplified_graph.add_node(current_block)
-                sum_length += current_node.g_score
+            _, _, current, current_length = heapq.heappop(open_set)
+            current_id = compact.ids[current]
+
+            if current_id not in simplified_graph.nodes:
+                simplified_graph.add_node(self.nodes[current_id])
+                sum_length += current_length
 
-            if current_node.id in self.edges:
-                for neighbor_id, _ in self.edges[current_node.id]:
+            for neighbor, _, _ in adjacency[current]:
 
-                    neighbor = self.nodes[neighbor_id]
-                    tentative_length = length_to_start[current_node.id] + current_node.g_score
+                tentative_length = length_to_start[current] + current_length
 
-                    if tentative_length > radio and not neighbor.contains_stop():
-                        continue
+                if tentative_length > radio and not stops[neighbor]:
+                    continue
 
-                    simplified_graph.add_edge(current_node.id, neighbor_id)
+                simplified_graph.add_edge(current_id, compact.ids[neighbor])
 
-                    if neighbor_id not in length_to_start or tentative_length < length_to_start[neighbor_id]:
-                        length_to_start[neighbor_id] = tentative_length
-                        heapq.heappush(open_set, Node(neighbor_id, g_score=neighbor.length, f_score=tentative_length))
+                if neighbor not in length_to_start or tentative_length < length_to_start[neighbor]:
+                    length_to_start[neighbor] = tentative_length
+                    heapq.heappush(open_set, (tentative_length, counter, neighbor, lengths[neighbor]))
+                    counter += 1
 
         simplified_graph.avg_length = sum_length / simplified_graph.count
         simplified_graph.is_simplified = True
@@ -0,0 +1,414 @@
+import json
+import os
+import shutil
+from collections.abc import Mapping
+from functools import cached_property, partial
+from pathlib import Path
+
+import numpy as np
+
+from map.compact_graph import CompactGraph
+from map.graph import Graph
+from map.map_elements import Block, Element, ElementType, Location, Route
+
+GRAPH_FILE_VERSION = 1
+NO_STRING = -1
+BUS_ROUTE = 0
+GAZELLE_ROUTE = 1
+
+TRAFFIC_SIGN_TYPES = [ElementType.STOP.value, ElementType.TRAFFIC_LIGHT.value, ElementType.GIVE_WAY.value,
+                      ElementType.CROSSING.value, ElementType.TRAIN_RAIL.value]
+STOP_TYPES = [ElementType.BUS_STOP.value, ElementType.GAZELLE_ROUTE.value]
+
+
+class StringTable:
+    """
+    Strings stored as one utf-8 blob and the offsets where every string starts, decoded on first access.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+        self.decoded = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        if position == NO_STRING:
+            return None
+
+        if position not in self.decoded:
+            start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+            self.decoded[position] = bytes(self.blob[start:end]).decode()
+
+        return self.decoded[position]
+
+    def decode(self, positions):
+        return [self[int(position)] for position in positions]
+
+
+class StringTableBuilder:
+
+    def __init__(self):
+        self.positions = {}
+        self.strings = []
+
+    def add(self, string):
+        if string is None:
+            return NO_STRING
+
+        if string not in self.positions:
+            self.positions[string] = len(self.strings)
+            self.strings.append(string)
+
+        return self.positions[string]
+
+    def arrays(self):
+        encoded = [string.encode() for string in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class LazyMapping(Mapping):
+    """
+    Read only mapping whose keys are computed on first use and whose values are built on first access from their
+    position among the keys.
+    """
+
+    def __init__(self, keys, build):
+        self.keys_source = keys
+        self.build = build
+        self.values_cache = {}
+
+    def __reduce__(self):
+        return LazyMapping, (self.keys_source, self.build)
+
+    @cached_property
+    def key_list(self):
+        return self.keys_source()
+
+    @cached_property
+    def positions(self):
+        return {key: position for position, key in enumerate(self.key_list)}
+
+    def __getitem__(self, key):
+        position = self.positions[key]
+
+        if position not in self.values_cache:
+            self.values_cache[position] = self.build(position)
+
+        return self.values_cache[position]
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __iter__(self):
+        return iter(self.key_list)
+
+    def __len__(self):
+        return len(self.key_list)
+
+
+class GraphFile:
+    """
+    Columnar on-disk representation of a Graph: a directory of .npy arrays opened as memory maps, so loading it does
+    not copy nor parse anything and processes opening the same file share its pages.
+
+    Every block id, edge target and listed block is a position in the ids table, whose first node_count entries are
+    the blocks of the graph in insertion order. Variable length lists (elements, arguments, edges, routes) are stored
+    as CSR pairs of offsets and values.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.meta = json.loads((Path(path) / "meta.json").read_text())
+
+        if self.meta["version"] != GRAPH_FILE_VERSION:
+            raise ValueError(f"Unsupported graph file version {self.meta['version']}")
+
+        self.arrays = {file.stem: np.load(file, mmap_mode='r') for file in Path(path).glob("*.npy")}
+        self.strings = StringTable(self.arrays["string_blob"], self.arrays["string_offsets"])
+        self.node_count = self.meta["node_count"]
+
+    def __reduce__(self):
+        return GraphFile, (self.path,)
+
+    def __getattr__(self, name):
+        arrays = self.__dict__.get("arrays", {})
+
+        if name in arrays:
+            return np.asarray(arrays[name])
+
+        raise AttributeError(name)
+
+    @cached_property
+    def ids(self):
+        return self.strings.decode(self.id_strings)
+
+    def node_ids(self):
+        return self.ids[:self.node_count]
+
+    @cached_property
+    def edge_sources(self):
+        return np.flatnonzero(self.has_edges).tolist()
+
+    def edge_ids(self):
+        return [self.ids[position] for position in self.edge_sources]
+
+    def build_block(self, position):
+        start, end = int(self.element_offsets[position]), int(self.element_offsets[position + 1])
+        elements = []
+
+        for element in range(start, end):
+            arguments_start = int(self.argument_offsets[element])
+            arguments_end = int(self.argument_offsets[element + 1])
+            element_position = float(self.element_position[element])
+
+            elements.append(Element(ElementType(int(self.element_type[element])),
+                                    self.strings.decode(self.arguments[arguments_start:arguments_end]),
+                                    int(element_position) if self.element_position_is_int[element]
+                                    else element_position))
+
+        return Block(way_id=int(self.way_id[position]),
+                     max_speed=int(self.max_speed[position]),
+                     location=Location(float(self.latitude[position]), float(self.longitude[position])),
+                     city=self.strings[int(self.city[position])],
+                     name=self.strings[int(self.name[position])],
+                     length=float(self.length[position]),
+                     between=(int(self.between[position, 0]), int(self.between[position, 1])),
+                     elements=elements,
+                     is_roundabout=bool(self.is_roundabout[position]))
+
+    def build_edges(self, key_position):
+        position = self.edge_sources[key_position]
+        start, end = int(self.edge_offsets[position]), int(self.edge_offsets[position + 1])
+
+        return {(self.ids[target], walk) for target, walk
+                in zip(self.edge_targets[start:end].tolist(), self.edge_walk[start:end].tolist())}
+
+    def map_keys(self):
+        return self.strings.decode(self.map_key_strings)
+
+    def build_map_entry(self, position):
+        return self.map_values[int(self.map_offsets[position]):int(self.map_offsets[position + 1])].tolist()
+
+    def municipalities(self):
+        return self.strings.decode(self.municipality_strings)
+
+    def build_municipality(self, position):
+        start, end = int(self.municipality_offsets[position]), int(self.municipality_offsets[position + 1])
+        return [self.ids[block] for block in self.municipality_blocks[start:end].tolist()]
+
+    def route_names(self, kind):
+        return self.strings.decode(self.route_keys[self.route_kind == kind])
+
+    def build_route(self, kind, nodes, position):
+        route = int(np.flatnonzero(self.route_kind == kind)[position])
+        trips = []
+
+        for trip in (2 * route, 2 * route + 1):
+            start, end = int(self.trip_offsets[trip]), int(self.trip_offsets[trip + 1])
+            trips.append([nodes[self.ids[block]] for block in self.trip_blocks[start:end].tolist()])
+
+        return Route(self.strings[int(self.route_names_strings[route])], trips[0], trips[1])
+
+    def places_of_interest(self):
+        keys = zip(self.strings.decode(self.place_kinds), self.place_osm_ids.tolist(),
+                   self.strings.decode(self.place_types))
+        values = zip(self.strings.decode(self.place_blocks), self.place_distances.tolist())
+        return dict(zip(keys, values))
+
+    def compact(self):
+        """
+        Builds the CompactGraph of the blocks straight from the arrays, without creating any Block.
+        """
+        count = self.node_count
+        edge_end = int(self.edge_offsets[count])
+        inside = self.edge_targets[:edge_end] < count
+        kept = np.concatenate([[0], np.cumsum(inside)])
+
+        element_type = self.element_type
+        element_offsets = self.element_offsets
+
+        def count_per_block(flags):
+            cumulative = np.concatenate([[0], np.cumsum(flags)])
+            return cumulative[element_offsets[1:]] - cumulative[element_offsets[:-1]]
+
+        ids = self.node_ids()
+
+        return CompactGraph(
+            ids=ids,
+            index={node_id: position for position, node_id in enumerate(ids)},
+            offsets=kept[self.edge_offsets[:count + 1]].astype(np.int32),
+            targets=self.edge_targets[:edge_end][inside].astype(np.int32),
+            walk=self.edge_walk[:edge_end][inside],
+            length=self.length,
+            speed=self.max_speed.astype(np.float64),
+            traffic_signs=count_per_block(np.isin(element_type, TRAFFIC_SIGN_TYPES)).astype(np.int32),
+            stops=count_per_block(np.isin(element_type, STOP_TYPES)) > 0,
+            latitudes=self.latitude,
+            longitudes=self.longitude
+        )
+
+
+def load_graph(path):
+    """
+    Opens a graph saved with save_graph. Blocks, edges and routes are built on first access, and the compact view of
+    the graph is built directly from the arrays.
+    Args:
+        path (str): directory of the graph file.
+    Returns:
+        Graph: the graph, its nodes and edges can not be modified.
+    """
+    graph_file = GraphFile(path)
+    graph = Graph()
+
+    graph.nodes = LazyMapping(graph_file.node_ids, graph_file.build_block)
+    graph.edges = LazyMapping(graph_file.edge_ids, graph_file.build_edges)
+    graph.map = LazyMapping(graph_file.map_keys, graph_file.build_map_entry)
+    graph.nodes_by_municipality = LazyMapping(graph_file.municipalities, graph_file.build_municipality)
+    graph.bus_routes = LazyMapping(partial(graph_file.route_names, BUS_ROUTE),
+                                   partial(graph_file.build_route, BUS_ROUTE, graph.nodes))
+    graph.gazelle_routes = LazyMapping(partial(graph_file.route_names, GAZELLE_ROUTE),
+                                       partial(graph_file.build_route, GAZELLE_ROUTE, graph.nodes))
+    graph.places_of_interest = graph_file.places_of_interest()
+    graph.count = graph_file.meta["count"]
+    graph.avg_length = graph_file.meta["avg_length"]
+    graph.is_simplified = graph_file.meta["is_simplified"]
+    graph.compact_graph = graph_file.compact()
+
+    return graph
+
+
+def save_graph(graph, path):
+    """
+    Saves a graph in the columnar format read by load_graph, replacing the directory if it exists.
+    Args:
+        graph (Graph): the graph to save.
+        path (str): directory where the arrays are written.
+    """
+    strings = StringTableBuilder()
+
+    ids = list(graph.nodes.keys())
+    id_positions = {node_id: position for position, node_id in enumerate(ids)}
+
+    def id_position(node_id):
+        if node_id not in id_positions:
+            id_positions[node_id] = len(ids)
+            ids.append(node_id)
+
+        return id_positions[node_id]
+
+    blocks = list(graph.nodes.values())
+    edge_keys = {id_position(node_id) for node_id in graph.edges.keys()}
+    edge_lists = {id_position(node_id): [(id_position(target), walk) for target, walk in edges]
+                  for node_id, edges in graph.edges.items()}
+    municipality_blocks = {municipality: [id_position(node_id) for node_id in node_ids]
+                           for municipality, node_ids in graph.nodes_by_municipality.items()}
+    place_blocks = [strings.add(block_id) for block_id, _ in graph.places_of_interest.values()]
+
+    routes = ([(BUS_ROUTE, key, route) for key, route in graph.bus_routes.items()]
+              + [(GAZELLE_ROUTE, key, route) for key, route in graph.gazelle_routes.items()])
+    trips = [[id_position(block.id) for block in trip] for _, _, route in routes for trip in route_trips(route)]
+
+    edge_offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    edge_targets = []
+    edge_walk = []
+
+    for position in range(len(ids)):
+        for target, walk in edge_lists.get(position, ()):
+            edge_targets.append(target)
+            edge_walk.append(walk)
+
+        edge_offsets[position + 1] = len(edge_targets)
+
+    elements = [element for block in blocks for element in block.elements]
+
+    arrays = {
+        "way_id": np.array([block.way_id for block in blocks], dtype=np.int64),
+        "max_speed": np.array([block.max_speed for block in blocks], dtype=np.int32),
+        "latitude": np.array([block.location.latitude for block in blocks], dtype=np.float64),
+        "longitude": np.array([block.location.longitude for block in blocks], dtype=np.float64),
+        "city": np.array([strings.add(block.city) for block in blocks], dtype=np.int32),
+        "name": np.array([strings.add(block.name) for block in blocks], dtype=np.int32),
+        "length": np.array([block.length for block in blocks], dtype=np.float64),
+        "between": np.array([block.between for block in blocks], dtype=np.int64).reshape(len(blocks), 2),
+        "is_roundabout": np.array([block.is_roundabout for block in blocks], dtype=np.bool_),
+        "element_offsets": offsets_of([block.elements for block in blocks]),
+        "element_type": np.array([element.type.value for element in elements], dtype=np.int8),
+        "element_position": np.array([element.position for element in elements], dtype=np.float64),
+        "element_position_is_int": np.array([isinstance(element.position, int) for element in elements],
+                                            dtype=np.bool_),
+        "argument_offsets": offsets_of([element.arguments for element in elements]),
+        "arguments": np.array([strings.add(argument) for element in elements for argument in element.arguments],
+                              dtype=np.int32),
+        "has_edges": np.isin(np.arange(len(ids)), list(edge_keys)),
+        "edge_offsets": edge_offsets,
+        "edge_targets": np.array(edge_targets, dtype=np.int32),
+        "edge_walk": np.array(edge_walk, dtype=np.bool_),
+        "map_key_strings": np.array([strings.add(key) for key in graph.map.keys()], dtype=np.int32),
+        "map_offsets": offsets_of(list(graph.map.values())),
+        "map_values": np.array([value for values in graph.map.values() for value in values], dtype=np.int64),
+        "municipality_strings": np.array([strings.add(municipality) for municipality in municipality_blocks],
+                                         dtype=np.int32),
+        "municipality_offsets": offsets_of(list(municipality_blocks.values())),
+        "municipality_blocks": np.array([block for blocks_in_municipality in municipality_blocks.values()
+                                         for block in blocks_in_municipality], dtype=np.int32),
+        "route_kind": np.array([kind for kind, _, _ in routes], dtype=np.int8),
+        "route_keys": np.array([strings.add(key) for _, key, _ in routes], dtype=np.int32),
+        "route_names_strings": np.array([strings.add(route.name) for _, _, route in routes], dtype=np.int32),
+        "trip_offsets": offsets_of(trips),
+        "trip_blocks": np.array([block for trip in trips for block in trip], dtype=np.int32),
+        "place_kinds": np.array([strings.add(kind) for kind, _, _ in graph.places_of_interest], dtype=np.int32),
+        "place_osm_ids": np.array([osm_id for _, osm_id, _ in graph.places_of_interest], dtype=np.int64),
+        "place_types": np.array([strings.add(place_type) for _, _, place_type in graph.places_of_interest],
+                                dtype=np.int32),
+        "place_blocks": np.array(place_blocks, dtype=np.int32),
+        "place_distances": np.array([length for _, length in graph.places_of_interest.values()], dtype=np.float64),
+        "id_strings": np.array([strings.add(node_id) for node_id in ids], dtype=np.int32),
+    }
+    arrays["string_blob"], arrays["string_offsets"] = strings.arrays()
+
+    meta = {"version": GRAPH_FILE_VERSION, "node_count": len(blocks), "count": graph.count,
+            "avg_length": graph.avg_length, "is_simplified": graph.is_simplified}
+
+    temporary_path = Path(f"{path}.tmp")
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    temporary_path.mkdir(parents=True)
+
+    for name, array in arrays.items():
+        np.save(temporary_path / f"{name}.npy", array)
+
+    (temporary_path / "meta.json").write_text(json.dumps(meta))
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temporary_path, path)
+
+
+def route_trips(route):
+    # graphs saved by older versions keep the return trip of one way routes as a reversed iterator of the outbound one
+    return_route = route.return_route if isinstance(route.return_route, list) else reversed(route.outbound_route)
+    return route.outbound_route, list(return_route)
+
+
+def offsets_of(lists):
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(values) for values in lists], out=offsets[1:])
+    return offsets
+
+
+class GraphFileFormat:
+    """
+    Artifact format of the store that saves graphs with save_graph and opens them with load_graph.
+    """
+    suffix = ".graph"
+
+    @staticmethod
+    def write(path, graph, shared):
+        save_graph(graph, path)
+
+    @staticmethod
+    def read(path, shared):
+        return load_graph(path)
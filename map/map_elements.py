@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 from enum import Enum, auto
 
-from geopy import distance
+from map import distance
 
 
 @dataclass
@@ -84,8 +84,8 @@ class Block:
         return ways
 
     def length_to(self, other):
-        return distance.distance((self.location.latitude, self.location.longitude),
-                                 (other.location.latitude, other.location.longitude)).kilometers
+        return distance.length(self.location.latitude, self.location.longitude,
+                               other.location.latitude, other.location.longitude)
 
 
 @dataclass
@@ -4,7 +4,9 @@ import math
 import osmium
 from shapely import Point, Polygon
 
+from map.node_table import NodeTable
 from map.osm_elements import WaySegment, Node, Location, Tag, Way, Relation, Member, Segment
+from map.spatial_index import PolygonIndex
 
 
 def read_poly_file(poly_file):
@@ -77,6 +79,7 @@ class MapHandler(osmium.SimpleHandler):
     def __init__(self, municipalities_file, gazelles_file):
         super(MapHandler, self).__init__()
         self.municipalities_polygons = read_poly_file(municipalities_file)
+        self.municipalities_index = PolygonIndex(self.municipalities_polygons)
         self.gazelle_routes = read_gazelles_file(gazelles_file)
         self.nodes = {}
         self.ways = {}
@@ -163,10 +166,9 @@ class MapHandler(osmium.SimpleHandler):
         if municipality.contains(point):
             return name
 
-        for name, municipality in self.municipalities_polygons:
-            if municipality.contains(point):
-                self.last_municipality = (name, municipality)
-                return name
+        for name, municipality in self.municipalities_index.containing(point)[:1]:
+            self.last_municipality = (name, municipality)
+            return name
 
         return None
 
@@ -199,3 +201,138 @@ class MapHandler(osmium.SimpleHandler):
             return self.ways.get(781656957, None)
         else:
             return self.ways.get(way_id, None)
+
+
+class StreamingMapHandler(MapHandler):
+    """
+    Two pass alternative to MapHandler with bounded memory. The first pass keeps the highways, the school and fuel
+    ways and the route, route master and restriction relations. The second pass materializes only the nodes those
+    elements reference, plus the school and fuel nodes, into a compact NodeTable. The resulting nodes, ways, relations
+    and places of interest produce the same graph as MapHandler.
+    """
+
+    kept_relations = ["route", "route_master", "restriction"]
+
+    def __init__(self, municipalities_file, gazelles_file):
+        super(StreamingMapHandler, self).__init__(municipalities_file, gazelles_file)
+        self.nodes = NodeTable()
+        self.referenced_nodes = set()
+        self.stop_routes = {}
+        self.way_places_of_interest = []
+
+    def apply_file(self, filename, *args, **kwargs):
+        WaysAndRelationsPass(self).apply_file(filename)
+        NodesPass(self).apply_file(filename)
+        self.nodes.freeze()
+        self.link_nodes()
+
+    def collect_way(self, way):
+
+        is_place_of_interest = "amenity" in way.tags and way.tags["amenity"] in ["fuel", "school"]
+
+        if "highway" not in way.tags and not is_place_of_interest:
+            return
+
+        new_way = Way(way.id, [node_ref.ref for node_ref in way.nodes], {tag.k: Tag(tag.k, tag.v) for tag in way.tags},
+                      [], [])
+        self.referenced_nodes.update(new_way.nodes)
+
+        if is_place_of_interest:
+            self.way_places_of_interest.append((("way", way.id, way.tags["amenity"]), new_way))
+
+        if way.id in self.double_way_streets:
+            new_way.tags["oneway"] = Tag("oneway", "no")
+
+        self.ways[way.id] = new_way
+
+    def collect_relation(self, relation):
+
+        if relation.id in self.violated_restrictions:
+            return
+
+        if "type" not in relation.tags or relation.tags["type"] not in self.kept_relations:
+            return
+
+        new_relation = Relation(
+            id=relation.id,
+            members=[Member(member.role, member.type, member.ref) for member in relation.members],
+            tags={tag.k: Tag(tag.k, tag.v) for tag in relation.tags})
+
+        self.relations[relation.id] = new_relation
+
+        if relation.tags["type"] == "route" and relation.tags.get("route") == "bus":
+            ways = [member for member in new_relation.members if member.role == "" and member.type == "w"]
+            nodes = [member for member in new_relation.members if "stop" in member.role and member.type == "n"]
+
+            for node_member in nodes:
+                self.stop_routes.setdefault(node_member.id, []).append(relation.id)
+
+            for i in range(len(ways)):
+                if relation.id == 6185688 and ways[i].id == 700611170:
+                    continue
+
+                way = self.get_way(relation.id, ways[i].id)
+
+                if way:
+                    way.bus_routes.append((i, relation.id))
+
+    def collect_node(self, node):
+
+        is_place_of_interest = "amenity" in node.tags and node.tags["amenity"] in ["fuel", "school"]
+
+        if node.id not in self.referenced_nodes and node.id not in self.stop_routes and not is_place_of_interest:
+            return
+
+        location = Location(node.location.lat, node.location.lon)
+        element_type = Node(node.id, None, location, {tag.k: Tag(tag.k, tag.v) for tag in node.tags}, [], []).type
+
+        self.nodes.append(node.id, location.latitude, location.longitude,
+                          self.get_municipality(Point(node.location.lon, node.location.lat)), element_type)
+
+        if is_place_of_interest:
+            self.places_of_interest[("node", node.id, node.tags["amenity"])] = get_polygon_from_point(
+                node.location.lat, node.location.lon)
+
+    def link_nodes(self):
+        """
+        Drops the references to nodes missing from the file and fills the way membership and bus routes of the nodes,
+        in the same order MapHandler would.
+        """
+        for way in self.ways.values():
+            way.nodes = [node_id for node_id in way.nodes if node_id in self.nodes]
+
+            for node_id in way.nodes:
+                self.nodes.part_of.setdefault(node_id, []).append(way)
+
+        for key, way in self.way_places_of_interest:
+            self.places_of_interest[key] = get_polygon_from_points([
+                (self.nodes[node_id].location.latitude, self.nodes[node_id].location.longitude)
+                for node_id in way.nodes])
+
+        for node_id, relation_ids in self.stop_routes.items():
+            if node_id in self.nodes:
+                self.nodes.bus_routes[node_id] = relation_ids
+
+        self.referenced_nodes = set()
+        self.way_places_of_interest = []
+
+
+class WaysAndRelationsPass(osmium.SimpleHandler):
+    def __init__(self, handler):
+        super(WaysAndRelationsPass, self).__init__()
+        self.handler = handler
+
+    def way(self, way):
+        self.handler.collect_way(way)
+
+    def relation(self, relation):
+        self.handler.collect_relation(relation)
+
+
+class NodesPass(osmium.SimpleHandler):
+    def __init__(self, handler):
+        super(NodesPass, self).__init__()
+        self.handler = handler
+
+    def node(self, node):
+        self.handler.collect_node(node)
@@ -1,20 +1,31 @@
 from pathlib import Path
 
 import dill
-from geopy import distance
 from shapely import Point
 
+from artifacts.store import ArtifactStore, CodeInput, FileInput, StageInput, LEGACY
+from map import distance
 from map.graph import Graph
+from map.graph_file import GraphFileFormat
 from map.map_elements import Element, Block, ElementType, Route
-from map.map_handler import MapHandler
+from map.map_handler import MapHandler, StreamingMapHandler
 from map.osm_elements import Tag, Way
 from map.relation_handler import RelationHandler
+from map.spatial_index import PolygonIndex
+from routing.landmarks import LANDMARKS_COUNT, Landmarks
+from routing.routing import edge_weights
+
+SIMPLIFY_RADIO = 0.5
+MAP_CODE = CodeInput("map.map_loader", "map.map_handler", "map.osm_elements", "map.map_elements",
+                     "map.relation_handler", "map.graph", "map.distance")
+GRAPH_FILE_CODE = CodeInput("map.graph_file")
 
 
 class MapLoader:
 
-    def __init__(self, city_map_file, municipalities_file, analyzed_municipalities):
+    def __init__(self, city_map_file, municipalities_file, analyzed_municipalities, streaming=False):
         self.city_map_file = city_map_file
+        self.streaming = streaming
         self.municipalities_file = municipalities_file
         self.analyzed_municipalities = analyzed_municipalities
         self.restrictions = ["route", "route_master", "restriction"]
@@ -26,26 +37,74 @@ class MapLoader:
         self.gazelle_routes = {}
         self.replaced = set()
 
-    def load_maps(self, path, gazelles_file):
-
-        if path:
-            saved_path = Path(f'{path}/graph.pkl')
-            if saved_path.exists():
-                cached_graph = dill.load(open(saved_path, 'rb'))
-
-                if isinstance(cached_graph, Graph):
-                    if Path(f'{path}/simplified_graph.pkl').exists():
-                        simplified_graph = dill.load(open(f'{path}/simplified_graph.pkl', 'rb'))
-
-                        if isinstance(simplified_graph, Graph):
-                            return cached_graph, simplified_graph
-
-                    simplified_graph = cached_graph.simplify(0.5)
-                    dill.dump(simplified_graph, open(f'{path}/simplified_graph.pkl', 'wb'))
+    def load_maps(self, path, gazelles_file, store=None, mapped=False):
+        """
+        Loads the complete and the simplified graph, parsing the map only when the artifacts saved in path were built
+        from other inputs.
+        Args:
+            path (str): folder of the saved artifacts, nothing is saved when it is None.
+            gazelles_file (str): file with the gazelle routes.
+            store (ArtifactStore): store of the artifacts, by default the one in path.
+            mapped (bool): whether to open the graphs from memory mapped graph files instead of pickles.
+        Returns:
+            tuple[Graph, Graph]: the complete and the simplified graph.
+        """
+        if store is None and path:
+            store = ArtifactStore(f'{path}/artifacts')
+
+        if store is None:
+            graph = self.build_graph(gazelles_file)
+            simplified_graph = graph.simplify(SIMPLIFY_RADIO)
+            MapLoader.load_landmarks(None, simplified_graph)
+            return graph, simplified_graph
+
+        graph_inputs = [FileInput(self.city_map_file), FileInput(self.municipalities_file), FileInput(gazelles_file),
+                        sorted(self.analyzed_municipalities), distance.DISTANCE_MODE, MAP_CODE]
+        simplified_graph_inputs = [StageInput("graph"), SIMPLIFY_RADIO, CodeInput("map.graph")]
+
+        def load_graph():
+            return store.load_or_build(
+                "graph", graph_inputs,
+                lambda: self.build_graph(gazelles_file),
+                expected_type=Graph,
+                legacy=lambda: self.load_legacy_graph(path) if path else None)
+
+        def load_simplified_graph(graph):
+            return store.load_or_build(
+                "simplified_graph", simplified_graph_inputs,
+                lambda: graph.simplify(SIMPLIFY_RADIO),
+                expected_type=Graph,
+                legacy=lambda: MapLoader.load_legacy_simplified_graph(path, graph, store) if path else None)
+
+        if mapped:
+            store.declare("graph", graph_inputs)
+            store.declare("simplified_graph", simplified_graph_inputs)
+
+            graph = store.load_or_build("graph_file", [StageInput("graph"), GRAPH_FILE_CODE], load_graph,
+                                        expected_type=Graph, artifact_format=GraphFileFormat)
+            simplified_graph = store.load_or_build("simplified_graph_file",
+                                                   [StageInput("simplified_graph"), GRAPH_FILE_CODE],
+                                                   lambda: load_simplified_graph(graph),
+                                                   expected_type=Graph, artifact_format=GraphFileFormat)
+        else:
+            graph = load_graph()
+            simplified_graph = load_simplified_graph(graph)
+
+        # identifies the graphs by the inputs they were built from, the route cache is kept for the same digest
+        graph.artifact_digest = store.digests["graph"]
+        simplified_graph.artifact_digest = store.digests["simplified_graph"]
+
+        MapLoader.load_landmarks(path, simplified_graph, store)
+        return graph, simplified_graph
 
-                    return cached_graph, simplified_graph
+    def build_graph(self, gazelles_file):
+        if not Path(self.city_map_file).exists():
+            raise FileNotFoundError(
+                f"The map {self.city_map_file} is needed to build the graph of {sorted(self.analyzed_municipalities)} "
+                f"with {distance.DISTANCE_MODE} distances, the saved maps are only reused for the municipalities and "
+                f"the distance mode they were built with")
 
-        handler = MapHandler(self.municipalities_file, gazelles_file)
+        handler = (StreamingMapHandler if self.streaming else MapHandler)(self.municipalities_file, gazelles_file)
         handler.apply_file(self.city_map_file)
         handler.populate_gazelle_routes()
 
@@ -53,17 +112,67 @@ class MapLoader:
         self.ways = handler.ways
         self.relations = handler.relations
 
-        graph = self.get_graph(handler.places_of_interest)
+        return self.get_graph(handler.places_of_interest)
 
-        if path and Path(path).exists():
-            dill.dump(graph, open(f'{path}/graph.pkl', 'wb'))
+    def load_legacy_graph(self, path):
+        """
+        Loads the graph saved before the artifact store existed, only if it was built for the analyzed municipalities
+        and with the distances of the current mode. Those graphs were built with geodesic distances.
+        """
+        if distance.DISTANCE_MODE != distance.GEODESIC or not Path(f'{path}/graph.pkl').exists():
+            return None
 
-        simplified_graph = graph.simplify(0.5)
+        graph = dill.load(open(f'{path}/graph.pkl', 'rb'))
+        return graph if set(graph.nodes_by_municipality) == set(self.analyzed_municipalities) else None
 
-        if path and Path(path).exists():
-            dill.dump(simplified_graph, open(f'{path}/simplified_graph.pkl', 'wb'))
+    @staticmethod
+    def load_legacy_simplified_graph(path, graph, store):
+        """
+        Loads the simplified graph saved before the artifact store existed, only if the graph was adopted from the
+        same legacy files and it is a simplification of it.
+        """
+        if store.statuses.get("graph") != LEGACY or not Path(f'{path}/simplified_graph.pkl').exists():
+            return None
 
-        return graph, simplified_graph
+        simplified_graph = dill.load(open(f'{path}/simplified_graph.pkl', 'rb'))
+
+        if not simplified_graph.is_simplified or not set(simplified_graph.nodes) <= set(graph.nodes):
+            return None
+
+        return simplified_graph
+
+    @staticmethod
+    def load_legacy_landmarks(path, weights):
+        landmarks = Landmarks.load(f'{path}/landmarks.pkl') if path else None
+        return landmarks if landmarks is not None and landmarks.attach(weights) else None
+
+    @staticmethod
+    def load_landmarks(path, graph, store=None):
+        """
+        Attaches the ALT landmarks to the graph, loading them when they were computed for the same graph and weights,
+        or computing and saving them otherwise.
+        """
+        weights = edge_weights(graph)
+
+        if store is not None:
+            landmarks = store.load_or_build(
+                "landmarks",
+                [StageInput("simplified_graph"), weights.obstacle_penalty, weights.walk_speed, LANDMARKS_COUNT,
+                 CodeInput("routing.landmarks", "routing.routing", "map.compact_graph")],
+                lambda: Landmarks.build(weights),
+                expected_type=Landmarks,
+                legacy=lambda: MapLoader.load_legacy_landmarks(path, weights),
+                shared={"weights": weights})
+        else:
+            landmarks = Landmarks.load(f'{path}/landmarks.pkl') if path else None
+
+        if landmarks is None or not landmarks.attach(weights):
+            landmarks = Landmarks.build(weights)
+
+            if path and store is None:
+                landmarks.save(f'{path}/landmarks.pkl')
+
+        graph.landmarks = landmarks
 
     def get_graph(self, places_of_interest):
         relations_by_type = RelationHandler.filter_relations(self.relations, self.restrictions)
@@ -73,6 +182,10 @@ class MapLoader:
         graph = Graph()
         roads = [way for way in self.ways.values() if way.is_road]
 
+        places_of_interest_index = PolygonIndex([((place_of_interest, item_location), polygon)
+                                                 for place_of_interest, (item_location, polygon)
+                                                 in places_of_interest.items()])
+
         sum_value = 0
 
         for way in roads:
@@ -143,7 +256,7 @@ class MapLoader:
                             block.id]
 
                     self.check_places_of_interest(last.location.latitude, last.location.longitude,
-                                                  block.id, places_of_interest)
+                                                  block.id, places_of_interest_index)
 
                     graph.map[f"{way.id}:_:{node_id}"] = graph.map.get(f"{way.id}:_:{node_id}", []) + [last.id]
                     graph.map[f"{way.id}:{last.id}:_"] = graph.map.get(f"{way.id}:{last.id}:_", []) + [node_id]
@@ -290,6 +403,7 @@ class MapLoader:
 
                 graph.edges[key] = set([(connection, walk) for connection, walk in graph.edges[key] if walk or
                                         not connection.startswith(f"{via_id}:")])
+                graph.invalidate()
 
                 for road_key in connected_roads:
 
@@ -317,24 +431,22 @@ class MapLoader:
                     else:
                         graph.add_edge(key, road_key)
 
-    def check_places_of_interest(self, latitude, longitude, key, places_of_interest):
+    def check_places_of_interest(self, latitude, longitude, key, places_of_interest_index):
 
         point = Point(latitude, longitude)
 
-        for place_of_interest, (item_location, polygon) in places_of_interest.items():
-
-            if polygon.contains(point):
+        for (place_of_interest, item_location), _ in places_of_interest_index.containing(point):
 
-                distance_value = distance.distance((latitude, longitude), item_location).kilometers
+            distance_value = distance.length(latitude, longitude, *item_location)
 
-                if place_of_interest in self.places_of_interest:
+            if place_of_interest in self.places_of_interest:
 
-                    _, length = self.places_of_interest[place_of_interest]
+                _, length = self.places_of_interest[place_of_interest]
 
-                    if length < distance_value:
-                        continue
+                if length < distance_value:
+                    continue
 
-                self.places_of_interest[place_of_interest] = (key, distance_value)
+            self.places_of_interest[place_of_interest] = (key, distance_value)
 
     def build_bus_routes(self, graph, route_masters):
 
@@ -378,7 +490,7 @@ class MapLoader:
             trips = [MapLoader.flatten(trip) for trip in trips if len(trip) > 0]
 
             if trips:
-                bus_routes[ref] = Route(ref, trips[0], trips[1] if len(trips) > 1 else reversed(trips[0]))
+                bus_routes[ref] = Route(ref, trips[0], trips[1] if len(trips) > 1 else list(reversed(trips[0])))
 
         return bus_routes
 
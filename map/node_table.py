@@ -0,0 +1,106 @@
+import numpy as np
+
+from map import distance
+from map.map_elements import ElementType, Location
+
+NO_MUNICIPALITY = -1
+NO_TYPE = 0
+
+
+class NodeTable:
+    """
+    Compact storage of OSM nodes: ids, coordinates, municipality codes and element type codes kept in arrays, with
+    the way membership and bus routes only for the nodes that have them. Nodes are read through NodeView objects that
+    behave like osm_elements.Node.
+    """
+
+    def __init__(self):
+        self.municipalities = []
+        self.municipality_codes = {}
+        self.rows = {}
+        self.ids = None
+        self.latitudes = None
+        self.longitudes = None
+        self.cities = None
+        self.types = None
+        self.part_of = {}
+        self.bus_routes = {}
+        self.pending = ([], [], [], [], [])
+
+    def append(self, node_id, latitude, longitude, city, element_type):
+        ids, latitudes, longitudes, cities, types = self.pending
+
+        if city is not None and city not in self.municipality_codes:
+            self.municipality_codes[city] = len(self.municipalities)
+            self.municipalities.append(city)
+
+        self.rows[node_id] = len(ids)
+        ids.append(node_id)
+        latitudes.append(latitude)
+        longitudes.append(longitude)
+        cities.append(self.municipality_codes[city] if city is not None else NO_MUNICIPALITY)
+        types.append(element_type.value if element_type is not None else NO_TYPE)
+
+    def freeze(self):
+        """
+        Moves the appended nodes into contiguous arrays, it must be called once every node has been appended.
+        """
+        ids, latitudes, longitudes, cities, types = self.pending
+
+        self.ids = np.array(ids, dtype=np.int64)
+        self.latitudes = np.array(latitudes, dtype=np.float64)
+        self.longitudes = np.array(longitudes, dtype=np.float64)
+        self.cities = np.array(cities, dtype=np.int16)
+        self.types = np.array(types, dtype=np.int8)
+        self.pending = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, node_id):
+        return node_id in self.rows
+
+    def __getitem__(self, node_id):
+        return NodeView(self, self.rows[node_id])
+
+    def get(self, node_id, default=None):
+        row = self.rows.get(node_id, None)
+        return NodeView(self, row) if row is not None else default
+
+
+class NodeView:
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    @property
+    def id(self):
+        return int(self.table.ids[self.row])
+
+    @property
+    def city(self):
+        code = int(self.table.cities[self.row])
+        return self.table.municipalities[code] if code != NO_MUNICIPALITY else None
+
+    @property
+    def location(self):
+        return Location(float(self.table.latitudes[self.row]), float(self.table.longitudes[self.row]))
+
+    @property
+    def type(self):
+        code = int(self.table.types[self.row])
+        return ElementType(code) if code != NO_TYPE else None
+
+    @property
+    def part_of(self):
+        return self.table.part_of.get(self.id, [])
+
+    @property
+    def bus_routes(self):
+        return self.table.bus_routes.get(self.id, [])
+
+    def length_to(self, other):
+        return distance.length(float(self.table.latitudes[self.row]), float(self.table.longitudes[self.row]),
+                               other.location.latitude, other.location.longitude)
@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 import numpy as np
-from geopy import distance
 
+from map import distance
 from map.map_elements import ElementType, Location
 
 
@@ -142,8 +142,8 @@ class Node:
         return None
 
     def length_to(self, other):
-        return distance.distance((self.location.latitude, self.location.longitude),
-                                 (other.location.latitude, other.location.longitude)).kilometers
+        return distance.length(self.location.latitude, self.location.longitude,
+                               other.location.latitude, other.location.longitude)
 
 
 @dataclass
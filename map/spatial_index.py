@@ -0,0 +1,20 @@
+from shapely import STRtree
+
+
+class PolygonIndex:
+    """
+    STRtree over a list of (key, polygon) pairs answering which polygons contain a point, in the order the polygons
+    were given.
+    """
+
+    def __init__(self, items):
+        self.keys = [key for key, _ in items]
+        self.polygons = [polygon for _, polygon in items]
+        self.tree = STRtree(self.polygons)
+
+    def containing(self, point):
+        """
+        Returns the (key, polygon) pairs whose polygon contains the point.
+        """
+        positions = sorted(self.tree.query(point, predicate="within").tolist())
+        return [(self.keys[position], self.polygons[position]) for position in positions]
@@ -1,7 +1,55 @@
+import math
+
 import numpy as np
 import skfuzzy as fuzz
 from skfuzzy import control as ctrl
 
+from artifacts.store import CodeInput, NpyFormat
+
+# (upper bound of the inferred value, low, high) of the ranges the value of a person is drawn from, high excluded
+MONEY_RANGES = ((250, 1, 101), (500, 101, 301), (math.inf, 301, 1000))
+WAITING_TIME_RANGES = ((45, 30, 60), (75, 60, 90), (math.inf, 90, 200))
+
+AGE_RANGE_VALUES = {
+    '15-19': 17,
+    '20-24': 22,
+    '25-39': 32,
+    '40-54': 47,
+    '55-64': 59,
+    '65+': 75
+}
+
+LOCATION_VALUES = {
+    'playa': 100,
+    '': 100,
+    'centro_habana': 100,
+    'habana-vieja': 100,
+    'regla': 66,
+    'habana_del_este': 66,
+    'guanabacoa': 66,
+    'san_miguel_del_padron': 66,
+    'diez_de_octubre': 66,
+    'cerro': 66,
+    'marianao': 66,
+    'la_lisa': 66,
+    'boyeros': 50,
+    'arroyo_naranjo': 50,
+    'cotorro': 50
+}
+
+EMPLOYMENT_STATUS_VALUES = {
+    'occupied': 20,
+    'student': 40,
+    'unoccupied': 60,
+    'other': 80
+}
+
+# every value the inputs of the systems can take, unknown labels are mapped to 0
+AGE_INPUTS = sorted({0, *AGE_RANGE_VALUES.values()})
+LOCATION_INPUTS = sorted({0, *LOCATION_VALUES.values()})
+EMPLOYMENT_STATUS_INPUTS = sorted({0, *EMPLOYMENT_STATUS_VALUES.values()})
+MONEY_INPUTS = list(range(0, 1001))
+
 
 class FuzzySystemMoney:
 
@@ -57,6 +105,11 @@ class FuzzySystemMoney:
         self.control_system = ctrl.ControlSystem(self.rules)
         self.control_system_simulation = ctrl.ControlSystemSimulation(self.control_system)
 
+        # outputs for every combination of the inputs, once compiled
+        self.table = None
+        # outputs of the inputs already evaluated without a compiled table
+        self.outputs = {}
+
     def infer_money(self, age_range_str, location_str):
         """
         Infers the money level based on the specified age range and location.
@@ -66,22 +119,65 @@ class FuzzySystemMoney:
         Returns:
             int: The inferred money level.
         """
+        inferred_money = self.compute_money(age_range_str, location_str)
+
+        for bound, low, high in MONEY_RANGES:
+            if inferred_money <= bound:
+                return np.random.randint(low, high)
+
+    def compute_money(self, age_range_str, location_str):
+        """
+        Returns:
+            float: the defuzzified output of the system, from which the money level is drawn.
+        """
         age_value = map_age_range(age_range_str)
         location_value = map_location(location_str)
 
+        if self.table is not None:
+            inferred_money = self.table[AGE_INPUTS.index(age_value), LOCATION_INPUTS.index(location_value)]
+            if not np.isnan(inferred_money):
+                return inferred_money
+
+        return memoized(self.outputs, self.evaluate, age_value, location_value)
+
+    def evaluate(self, age_value, location_value):
         self.control_system_simulation.input['age'] = age_value
         self.control_system_simulation.input['location'] = location_value
 
         self.control_system_simulation.compute()
 
-        inferred_money = self.control_system_simulation.output['money']
+        return self.control_system_simulation.output['money']
+
+    def compile(self, store=None):
+        """
+        Evaluates the system once for every combination of its inputs, after which their outputs are looked up in a
+        table instead of computed.
+        Args:
+            store (ArtifactStore): store where the table is saved, so it is only evaluated again when this module
+                changes.
+        """
+        if self.table is not None:
+            return
+
+        build = lambda: evaluate_grid(self.evaluate, AGE_INPUTS, LOCATION_INPUTS)
 
-        if inferred_money <= 250:
-            return np.random.randint(1, 101)
-        elif inferred_money <= 500:
-            return np.random.randint(101, 301)
+        if store is None:
+            self.table = build()
         else:
-            return np.random.randint(301, 1000)
+            self.table = store.load_or_build("fuzzy_money_table", [CodeInput("population.fuzzy_system")], build,
+                                             expected_type=np.ndarray, artifact_format=NpyFormat)
+
+    def compute_money_batch(self, age_ranges, locations):
+        """
+        Vectorized compute_money of a compiled system.
+        Args:
+            age_ranges (np.ndarray): the age range of every person.
+            locations (np.ndarray): the location of every person.
+        Returns:
+            np.ndarray: the defuzzified output for every person.
+        """
+        return lookup(self.table, input_positions(age_ranges, map_age_range, AGE_INPUTS),
+                      input_positions(locations, map_location, LOCATION_INPUTS))
 
 
 class FuzzySystemWaitingTime:
@@ -131,6 +227,11 @@ class FuzzySystemWaitingTime:
         self.control_system = ctrl.ControlSystem(self.rules)
         self.control_system_simulation = ctrl.ControlSystemSimulation(self.control_system)
 
+        # outputs for every combination of the inputs, once compiled
+        self.table = None
+        # outputs of the inputs already evaluated without a compiled table
+        self.outputs = {}
+
     def infer_max_waiting_time(self, age_range_str, money_level_str, employment_status_str):
         """
         Infers the maximum waiting time based on the specified inputs.
@@ -141,24 +242,70 @@ class FuzzySystemWaitingTime:
         Returns:
             int: The inferred maximum waiting time.
         """
+        max_waiting_time = self.compute_max_waiting_time(age_range_str, money_level_str, employment_status_str)
+
+        for bound, low, high in WAITING_TIME_RANGES:
+            if max_waiting_time <= bound:
+                return np.random.randint(low, high)
+
+    def compute_max_waiting_time(self, age_range_str, money_level_str, employment_status_str):
+        """
+        Returns:
+            float: the defuzzified output of the system, from which the maximum waiting time is drawn.
+        """
         age_value = map_age_range(age_range_str)
         money_value = int(money_level_str)
         employment_status_value = map_employment_status(employment_status_str)
 
+        if self.table is not None and 0 <= money_value < len(MONEY_INPUTS):
+            max_waiting_time = self.table[AGE_INPUTS.index(age_value), money_value,
+                                          EMPLOYMENT_STATUS_INPUTS.index(employment_status_value)]
+            if not np.isnan(max_waiting_time):
+                return max_waiting_time
+
+        return memoized(self.outputs, self.evaluate, age_value, money_value, employment_status_value)
+
+    def evaluate(self, age_value, money_value, employment_status_value):
         self.control_system_simulation.input['age'] = age_value
         self.control_system_simulation.input['money'] = money_value
         self.control_system_simulation.input['employment_status'] = employment_status_value
 
         self.control_system_simulation.compute()
 
-        max_waiting_time = self.control_system_simulation.output['max_waiting_time']
+        return self.control_system_simulation.output['max_waiting_time']
+
+    def compile(self, store=None):
+        """
+        Evaluates the system once for every combination of its inputs, after which their outputs are looked up in a
+        table instead of computed.
+        Args:
+            store (ArtifactStore): store where the table is saved, so it is only evaluated again when this module
+                changes.
+        """
+        if self.table is not None:
+            return
+
+        build = lambda: evaluate_grid(self.evaluate, AGE_INPUTS, MONEY_INPUTS, EMPLOYMENT_STATUS_INPUTS)
 
-        if max_waiting_time <= 45:
-            return np.random.randint(30, 60)
-        elif max_waiting_time <= 75:
-            return np.random.randint(60, 90)
+        if store is None:
+            self.table = build()
         else:
-            return np.random.randint(90, 200)
+            self.table = store.load_or_build("fuzzy_waiting_time_table", [CodeInput("population.fuzzy_system")],
+                                             build, expected_type=np.ndarray, artifact_format=NpyFormat)
+
+    def compute_max_waiting_time_batch(self, age_ranges, money_levels, employment_statuses):
+        """
+        Vectorized compute_max_waiting_time of a compiled system.
+        Args:
+            age_ranges (np.ndarray): the age range of every person.
+            money_levels (np.ndarray): the money level of every person, between 0 and 1000.
+            employment_statuses (np.ndarray): the employment status of every person.
+        Returns:
+            np.ndarray: the defuzzified output for every person.
+        """
+        return lookup(self.table, input_positions(age_ranges, map_age_range, AGE_INPUTS),
+                      np.asarray(money_levels, dtype=np.intp),
+                      input_positions(employment_statuses, map_employment_status, EMPLOYMENT_STATUS_INPUTS))
 
 
 def map_age_range(age_range_str):
@@ -169,15 +316,7 @@ def map_age_range(age_range_str):
     Returns:
     int: The numerical value corresponding to the age range.
     """
-    age_range_map = {
-        '15-19': 17,
-        '20-24': 22,
-        '25-39': 32,
-        '40-54': 47,
-        '55-64': 59,
-        '65+': 75
-    }
-    return age_range_map.get(age_range_str, 0)
+    return AGE_RANGE_VALUES.get(age_range_str, 0)
 
 
 def map_location(location_str):
@@ -188,24 +327,7 @@ def map_location(location_str):
     Returns:
     int: The numerical value corresponding to the location.
     """
-    location_map = {
-        'playa': 100,
-        '': 100,
-        'centro_habana': 100,
-        'habana-vieja': 100,
-        'regla': 66,
-        'habana_del_este': 66,
-        'guanabacoa': 66,
-        'san_miguel_del_padron': 66,
-        'diez_de_octubre': 66,
-        'cerro': 66,
-        'marianao': 66,
-        'la_lisa': 66,
-        'boyeros': 50,
-        'arroyo_naranjo': 50,
-        'cotorro': 50
-    }
-    return location_map.get(location_str, 0)
+    return LOCATION_VALUES.get(location_str, 0)
 
 
 def map_employment_status(employment_status_str):
@@ -216,10 +338,67 @@ def map_employment_status(employment_status_str):
     Returns:
         int: The numerical value corresponding to the employment status.
     """
-    employment_status_map = {
-        'occupied': 20,
-        'student': 40,
-        'unoccupied': 60,
-        'other': 80
-    }
-    return employment_status_map.get(employment_status_str, 0)
+    return EMPLOYMENT_STATUS_VALUES.get(employment_status_str, 0)
+
+
+def memoized(outputs, evaluate, *values):
+    """
+    Evaluates a system only the first time it is given the values, so generating people one by one costs at most one
+    evaluation per distinct combination of inputs instead of compiling the whole table.
+    """
+    if values not in outputs:
+        outputs[values] = evaluate(*values)
+
+    return outputs[values]
+
+
+def evaluate_grid(evaluate, *inputs):
+    """
+    Evaluates a system for every combination of the values of its inputs, the combinations for which it has no output
+    are nan.
+    Returns:
+        np.ndarray: the outputs, with an axis per input.
+    """
+    table = np.full(tuple(len(values) for values in inputs), np.nan)
+
+    for position in np.ndindex(table.shape):
+        try:
+            table[position] = evaluate(*(values[index] for values, index in zip(inputs, position)))
+        except ValueError:
+            pass
+
+    return table
+
+
+def input_positions(labels, to_value, inputs):
+    """
+    Returns:
+        np.ndarray: the position among the inputs of the value of every label.
+    """
+    unique_labels, inverse = np.unique(np.asarray(labels), return_inverse=True)
+    positions = np.array([inputs.index(to_value(label)) for label in unique_labels.tolist()], dtype=np.intp)
+    return positions[inverse.reshape(-1)]
+
+
+def lookup(table, *positions):
+    outputs = table[positions]
+
+    if np.isnan(outputs).any():
+        raise ValueError("The fuzzy system has no output for some of the inputs")
+
+    return outputs
+
+
+def draw_from_ranges(values, ranges, rng):
+    """
+    Draws, for every inferred value, an integer from the range it falls into.
+    Args:
+        values (np.ndarray): the defuzzified outputs.
+        ranges (tuple[tuple[float, int, int]]): the ranges, as MONEY_RANGES.
+        rng (np.random.Generator): generator of the draws.
+    Returns:
+        np.ndarray: the drawn integers.
+    """
+    bounds, lows, highs = (np.array(column) for column in zip(*ranges))
+    positions = np.searchsorted(bounds, values, side="left")
+    return rng.integers(lows[positions], highs[positions])
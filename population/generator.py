@@ -3,26 +3,43 @@ import random
 from pathlib import Path
 
 import dill
+import numpy as np
 
-from gemini.llm import walk_speed
-from population.fuzzy_system import FuzzySystemMoney, FuzzySystemWaitingTime
+from artifacts.store import ArtifactStore, CodeInput, FileInput
+from gemini.parameters import ParameterProvider
+from population.fuzzy_system import FuzzySystemMoney, FuzzySystemWaitingTime, MONEY_RANGES, WAITING_TIME_RANGES, \
+    draw_from_ranges
+
+# columns of the populations generated in batch, attributes a person does not have are empty strings
+CATEGORICAL_FIELDS = ("municipality", "employment_status", "workplace_location", "work_schedule", "age",
+                      "student_type", "school_schedule", "bachelor_type")
+NUMERIC_FIELDS = (("money", np.int32), ("max_waiting_time", np.int32), ("walk_speed", np.float64))
+# attributes the passengers read from every profile, and from the profiles of each employment status
+PASSENGER_FIELDS = ("municipality", "employment_status", "max_waiting_time", "walk_speed")
+EMPLOYMENT_FIELDS = {"occupied": ("workplace_location", "work_schedule"), "student": ("student_type", "school_schedule")}
 
 
 class PopulationGenerator:
 
-    def __init__(self, population_path):
+    def __init__(self, population_path, store=None, parameters=None):
         """
         Initializes the PopulationGenerator instance with the data from the specified file.
         Args:
             population_path (str): where population1 data is located.
+            store (ArtifactStore): store of the generated populations, by default the one in population_path.
+            parameters (ParameterProvider): provider of the walking speeds, by default one cached in population_path.
         """
 
         if not Path(population_path).exists():
             raise FileNotFoundError(population_path)
 
         self.population_path = population_path
+        self.store = store if store is not None else ArtifactStore(f"{population_path}/artifacts")
+        self.parameters = parameters if parameters is not None else \
+            ParameterProvider(f"{population_path}/parameters.json")
         self.data = PopulationGenerator.load_data(f"{population_path}/demographic_data.json")
         self.cumulative_ranges = self.calculate_cumulative_ranges()
+        self.distributions = self.calculate_distributions()
         self.fuzzy_system_money = FuzzySystemMoney()
         self.fuzzy_system_waiting_time = FuzzySystemWaitingTime()
 
@@ -77,6 +94,63 @@ class PopulationGenerator:
 
         return cumulative_ranges
 
+    def calculate_distributions(self):
+        """
+        Converts the cumulative ranges into arrays for np.searchsorted, with the values coded as their positions in
+        self.categories, whose first category is the empty string.
+        Returns:
+            dict: the codes and cumulative probabilities of every attribute, by value of the conditional attribute for
+            the conditional ones.
+        """
+        categories = [""]
+        self.category_codes = {"": 0}
+
+        def distribution(cumulative_range):
+            for key in cumulative_range:
+                if key not in self.category_codes:
+                    self.category_codes[key] = len(categories)
+                    categories.append(key)
+
+            return (np.array([self.category_codes[key] for key in cumulative_range], dtype=np.int32),
+                    np.array(list(cumulative_range.values())))
+
+        distributions = {}
+
+        for attribute_name, cumulative_range in self.cumulative_ranges.items():
+            if all(isinstance(value, dict) for value in cumulative_range.values()):
+                distributions[attribute_name] = {key: distribution(value) for key, value in cumulative_range.items()}
+            else:
+                distributions[attribute_name] = distribution(cumulative_range)
+
+        self.categories = np.array(categories)
+        return distributions
+
+    def sample_attribute(self, attribute_name, rng, size, conditional_codes=None):
+        """
+        Generates values of an attribute for many people at once.
+        Args:
+            attribute_name (str): The name of the attribute for which to generate the values.
+            rng (np.random.Generator): generator of the draws.
+            size (int): amount of values to generate.
+            conditional_codes (np.ndarray): code of the value of the conditional attribute of every person, if any.
+        Returns:
+            np.ndarray: the codes of the generated values.
+        """
+        rand_values = rng.random(size)
+
+        if conditional_codes is None:
+            codes, cumulative = self.distributions[attribute_name]
+            return codes[np.minimum(np.searchsorted(cumulative, rand_values), len(codes) - 1)]
+
+        values = np.zeros(size, dtype=np.int32)
+
+        for conditional_code in np.unique(conditional_codes):
+            group = conditional_codes == conditional_code
+            codes, cumulative = self.distributions[attribute_name][self.categories[conditional_code]]
+            values[group] = codes[np.minimum(np.searchsorted(cumulative, rand_values[group]), len(codes) - 1)]
+
+        return values
+
     def generate_attribute(self, attribute_name, conditional_attribute=None):
         """
         Generates a random value for a given attribute.
@@ -146,29 +220,179 @@ class PopulationGenerator:
                                                                                            person['money'],
                                                                                            person['employment_status'])
 
-        person["walk_speed"] = walk_speed(person['employment_status'], person.get("student_type", ""), person["age"])
+        person["walk_speed"] = self.parameters.walk_speed(person['employment_status'], person.get("student_type", ""),
+                                                          person["age"])
 
         return person
 
-    def generate_population(self, n):
+    def generate_batch(self, n, rng):
+        """
+        Generates the data of n people at once, sampling every attribute for the whole population and branching by
+        group of people instead of by person.
+        Args:
+            n (int): The size of the population to generate.
+            rng (np.random.Generator): generator of the draws.
+        Returns:
+            np.ndarray: structured array with a row per person and the fields CATEGORICAL_FIELDS and NUMERIC_FIELDS.
+        """
+        columns = {field: np.zeros(n, dtype=np.int32) for field in CATEGORICAL_FIELDS}
+        categories = self.categories
+        code = self.category_codes.get
+
+        def sample(field, attribute_name, people, conditional_field=None):
+            conditional_codes = columns[conditional_field][people] if conditional_field else None
+            columns[field][people] = self.sample_attribute(attribute_name, rng, int(np.count_nonzero(people)),
+                                                           conditional_codes)
+
+        everyone = np.ones(n, dtype=bool)
+        sample("municipality", "municipality", everyone)
+        sample("employment_status", "employment_status", everyone, "municipality")
+
+        occupied = columns["employment_status"] == code("occupied")
+        sample("workplace_location", "workplace_location", occupied, "municipality")
+        sample("work_schedule", "work_schedule", occupied)
+
+        sample("age", "age", everyone, "employment_status")
+
+        students = columns["employment_status"] == code("student")
+        sample("student_type", "student_type", students, "age")
+        sample("school_schedule", "school_schedule", students, "student_type")
+
+        bachelors = columns["student_type"] == code("bachelor")
+        sample("bachelor_type", "bachelor_type", bachelors)
+
+        medicine = columns["bachelor_type"] == code("medicine")
+        sample("workplace_location", "workplace_location", medicine, "municipality")
+        other_bachelors = bachelors & ~medicine
+        sample("workplace_location", "municipality_by_student_type", other_bachelors, "bachelor_type")
+
+        high_school = columns["student_type"] == code("high_school")
+        columns["workplace_location"][high_school] = columns["municipality"][high_school]
+        other_students = students & ~bachelors & ~high_school
+        sample("workplace_location", "municipality_by_student_type", other_students, "student_type")
+
+        self.compile_fuzzy_systems()
+
+        inferred_money = self.fuzzy_system_money.compute_money_batch(categories[columns["age"]],
+                                                                     categories[columns["municipality"]])
+        money = draw_from_ranges(inferred_money, MONEY_RANGES, rng)
+
+        inferred_waiting_time = self.fuzzy_system_waiting_time.compute_max_waiting_time_batch(
+            categories[columns["age"]], money, categories[columns["employment_status"]])
+        max_waiting_time = draw_from_ranges(inferred_waiting_time, WAITING_TIME_RANGES, rng)
+
+        # the walking speed only depends on categories, so it is asked once per combination present in the population
+        def speed(combinations):
+            values = self.parameters.get_many(
+                ("walk_speed", categories[status], categories[student_type], categories[age])
+                for status, student_type, age in combinations)
+            return [np.nan if value is None else value for value in values]
+
+        speeds = self.map_combinations(speed, columns["employment_status"], columns["student_type"], columns["age"])
+
+        table = np.empty(n, dtype=[(field, categories.dtype) for field in CATEGORICAL_FIELDS] + list(NUMERIC_FIELDS))
+
+        for field in CATEGORICAL_FIELDS:
+            table[field] = categories[columns[field]]
+
+        table["money"] = money
+        table["max_waiting_time"] = max_waiting_time
+        table["walk_speed"] = speeds
+
+        return table
+
+    def compile_fuzzy_systems(self):
+        """
+        Replaces the inference of the fuzzy systems by lookup tables, saved in the store. It is called before
+        generating a batch and only compiles the systems the first time, people generated one by one only evaluate the
+        systems for the inputs they use.
+        """
+        self.fuzzy_system_money.compile(self.store)
+        self.fuzzy_system_waiting_time.compile(self.store)
+
+    @staticmethod
+    def map_combinations(function, *columns):
+        """
+        Applies the function to every row of the non negative integer columns, calling it once with the list of
+        distinct combinations of values, so they can be computed together.
+        Args:
+            function (Callable[[list[tuple[int]]], list[float]]): the result of every combination.
+        Returns:
+            np.ndarray: the float result of every row.
+        """
+        keys = np.zeros(len(columns[0]), dtype=np.int64)
+
+        for column in columns:
+            keys = keys * (int(column.max(initial=0)) + 1) + column
+
+        _, first_rows, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        combinations = [tuple(int(column[row]) for column in columns) for row in first_rows]
+        results = np.array(function(combinations), dtype=float)
+
+        return results[inverse.reshape(-1)]
+
+    @staticmethod
+    def to_profiles(table):
+        """
+        Converts a population generated in batch into the dictionaries of generate_person, without the attributes
+        the person does not have.
+        """
+        profiles = []
+
+        for row in table.tolist():
+            profile = {field: value for field, value in zip(CATEGORICAL_FIELDS, row) if value != ""}
+            profile["money"], profile["max_waiting_time"], speed = row[len(CATEGORICAL_FIELDS):]
+            profile["walk_speed"] = None if np.isnan(speed) else speed
+            profiles.append(profile)
+
+        return profiles
+
+    def generate_population(self, n, batch=False):
         """
         Generates a population1 of people.
         Args:
             n (int): The size of the population1 to generate.
+            batch (bool): whether to generate the whole population at once with generate_batch, seeded from the
+                random module.
         Returns:
-            list: A list of dictionaries, where each dictionary represents the data of a person.
+            list | np.ndarray: A list of dictionaries, where each dictionary represents the data of a person, or the
+            structured array of generate_batch.
         """
 
+        if batch:
+            return self.store.load_or_build(
+                "population_table",
+                [FileInput(f"{self.population_path}/demographic_data.json"), n, self.parameters.backend.name,
+                 CodeInput("population.generator", "population.fuzzy_system")],
+                lambda: self.generate_batch(n, np.random.default_rng(random.getrandbits(64))),
+                expected_type=np.ndarray)
+
+        return self.store.load_or_build(
+            "population",
+            [FileInput(f"{self.population_path}/demographic_data.json"), n, self.parameters.backend.name,
+             CodeInput("population.generator", "population.fuzzy_system")],
+            lambda: [self.generate_person() for _ in range(n)],
+            expected_type=list,
+            legacy=lambda: self.load_legacy_population(n))
+
+    def load_legacy_population(self, n):
+        """
+        Loads the population saved before the artifact store existed, only if it has the requested size and every
+        attribute the passengers read, populations saved by older versions are generated again.
+        """
         cached_population_path = f"{self.population_path}/population.pkl"
 
-        if Path(cached_population_path).exists():
-            return dill.load(open(cached_population_path, 'rb'))
-
-        population = []
+        if not Path(cached_population_path).exists():
+            return None
 
-        for _ in range(n):
-            population.append(self.generate_person())
+        population = dill.load(open(cached_population_path, 'rb'))
 
-        dill.dump(population, open(cached_population_path, 'wb'))
+        if len(population) != n or not all(PopulationGenerator.has_passenger_fields(person) for person in population):
+            return None
 
         return population
+
+    @staticmethod
+    def has_passenger_fields(person):
+        fields = PASSENGER_FIELDS + EMPLOYMENT_FIELDS.get(person.get("employment_status"), ())
+        return all(field in person for field in fields)
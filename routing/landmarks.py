@@ -0,0 +1,194 @@
+import heapq
+from pathlib import Path
+
+import dill
+import numpy as np
+
+LANDMARKS_COUNT = 16
+
+DRIVE = "drive"
+WALK = "walk"
+
+
+class Landmarks:
+    """
+    ALT (A*, landmarks and triangle inequality) preprocessing of a graph. For a handful of landmark blocks it stores
+    the exact cost from every block to the landmark and from the landmark to every block, for both the drive mode
+    (walk edges excluded) and the walk mode (every edge, each one with the cost of its flag). Those distances give
+    admissible lower bounds for any query, even when some blocks are blocked.
+    """
+
+    def __init__(self, ids, positions, obstacle_penalty, walk_speed, distances, fingerprint):
+        self.ids = ids
+        self.positions = positions
+        self.obstacle_penalty = obstacle_penalty
+        self.walk_speed = walk_speed
+        self.distances = distances
+        # fingerprint of the edge weights the distances were computed with
+        self.fingerprint = fingerprint
+        self.weights = None
+
+    @staticmethod
+    def build(weights, count=LANDMARKS_COUNT):
+        """
+        Selects the landmarks with the farthest first strategy and computes their distance tables.
+        Args:
+            weights (EdgeWeights): the edge weights of the graph to preprocess.
+            count (int): amount of landmarks to select.
+        Returns:
+            Landmarks: the preprocessed landmarks.
+        """
+        compact = weights.compact
+        forward = {DRIVE: [[(target, cost) for target, walk, cost in edges if not walk]
+                           for edges in weights.adjacency],
+                   WALK: [[(target, cost) for target, _, cost in edges] for edges in weights.adjacency]}
+        backward = {mode: reverse_adjacency(adjacency) for mode, adjacency in forward.items()}
+
+        positions = select_landmarks(forward[DRIVE], backward[DRIVE], min(count, compact.count))
+
+        distances = {
+            mode: (np.array([dijkstra(forward[mode], position) for position in positions]),
+                   np.array([dijkstra(backward[mode], position) for position in positions]))
+            for mode in (DRIVE, WALK)
+        }
+
+        landmarks = Landmarks(list(compact.ids), positions, weights.obstacle_penalty, weights.walk_speed, distances,
+                              weights.fingerprint)
+        landmarks.weights = weights
+        return landmarks
+
+    def attach(self, weights):
+        """
+        Binds the landmarks to the edge weights they were computed from, returns False if they do not match: other
+        blocks, edges or edge costs would make their bounds inadmissible. Landmarks saved without a fingerprint never
+        match.
+        """
+        if getattr(self, "fingerprint", None) != weights.fingerprint:
+            return False
+
+        self.weights = weights
+        return True
+
+    def matches(self, weights):
+        return self.weights is (weights.base or weights)
+
+    def lower_bounds(self, goal_positions, walk):
+        """
+        Computes a lower bound of the cost from every block to the closest of the goals.
+        Args:
+            goal_positions (list[int]): positions of the goal blocks in the compact graph.
+            walk (bool): whether walk edges are allowed.
+        Returns:
+            list[float]: the lower bound for every block.
+        """
+        from_landmarks, to_landmarks = self.distances[WALK if walk else DRIVE]
+
+        bounds = np.zeros(from_landmarks.shape[1])
+
+        with np.errstate(invalid="ignore"):
+            for landmark in range(from_landmarks.shape[0]):
+                to_goals = from_landmarks[landmark, goal_positions]
+                finite = np.isfinite(to_goals)
+
+                if finite.any():
+                    # d(v, t) >= d(l, t) - d(l, v) for every goal reachable from the landmark
+                    bound = to_goals[finite].min() - from_landmarks[landmark]
+                    np.maximum(bounds, np.where(np.isfinite(bound), bound, 0), out=bounds)
+
+                from_goals = to_landmarks[landmark, goal_positions]
+
+                if np.isfinite(from_goals).all():
+                    # d(v, t) >= d(v, l) - d(t, l)
+                    bound = to_landmarks[landmark] - from_goals.max()
+                    np.maximum(bounds, np.where(np.isfinite(bound), bound, 0), out=bounds)
+
+        return bounds.tolist()
+
+    def save(self, path):
+        weights = self.weights
+        self.weights = None
+        try:
+            dill.dump(self, open(path, 'wb'))
+        finally:
+            self.weights = weights
+
+    @staticmethod
+    def load(path):
+        if not Path(path).exists():
+            return None
+
+        landmarks = dill.load(open(path, 'rb'))
+        return landmarks if isinstance(landmarks, Landmarks) else None
+
+
+def reverse_adjacency(adjacency):
+    reversed_adjacency = [[] for _ in adjacency]
+
+    for position, edges in enumerate(adjacency):
+        for target, cost in edges:
+            reversed_adjacency[target].append((position, cost))
+
+    return reversed_adjacency
+
+
+def dijkstra(adjacency, sources):
+    if isinstance(sources, int):
+        sources = [sources]
+
+    distances = [float('inf')] * len(adjacency)
+    open_set = []
+
+    for source in sources:
+        distances[source] = 0
+        open_set.append((0, source))
+
+    heapq.heapify(open_set)
+
+    while open_set:
+        current_distance, current = heapq.heappop(open_set)
+
+        if current_distance > distances[current]:
+            continue
+
+        for neighbor, cost in adjacency[current]:
+            tentative_distance = current_distance + cost
+
+            if tentative_distance < distances[neighbor]:
+                distances[neighbor] = tentative_distance
+                heapq.heappush(open_set, (tentative_distance, neighbor))
+
+    return distances
+
+
+def select_landmarks(forward, backward, count):
+    """
+    Farthest first selection: every new landmark is the block farthest from the ones already selected, measured in
+    both directions and restricted to blocks reachable from them.
+    """
+    if count == 0:
+        return []
+
+    selected = []
+    candidate = 0
+
+    while len(selected) < count:
+        distances = np.minimum(dijkstra(forward, selected or [candidate]),
+                               dijkstra(backward, selected or [candidate]))
+
+        if selected:
+            distances[selected] = -1
+
+        reachable = np.where(np.isfinite(distances), distances, -1)
+        farthest = int(reachable.argmax())
+
+        if reachable[farthest] <= 0:
+            unreached = np.flatnonzero(~np.isfinite(distances))
+
+            if len(unreached) == 0:
+                break
+
+            farthest = int(unreached[0])
+
+        selected.append(farthest)
+
+    return selected
@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from pathlib import Path
+
+import dill
+
+
+class RouteCache:
+    """
+    Bounded LRU cache of route plans keyed by (origin block id, destination block ids, radio, mode). The cached
+    plans are shared between callers, so they must not be modified in place.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.graph = None
+        self.signature = None
+        self.hits = 0
+        self.misses = 0
+        # entries put since start_recording, None when not recording
+        self.recorded = None
+
+    @staticmethod
+    def graph_signature(graph):
+        """
+        Returns:
+            str: digest of the artifact of the graph when it was loaded from an ArtifactStore, so routes persisted by
+            other runs are kept for the same artifact, or a hash of its blocks and edges otherwise.
+        """
+        digest = getattr(graph, "artifact_digest", None)
+        return digest if digest is not None else graph.compact().fingerprint
+
+    @staticmethod
+    def key(src, dest, radio, mode):
+        dest_ids = tuple(block.id for block in dest) if isinstance(dest, list) else (dest.id,)
+        return src.id, dest_ids, radio, mode
+
+    def bind(self, graph):
+        """
+        Makes sure the cached routes belong to the given graph, dropping them otherwise.
+        """
+        if graph is self.graph:
+            return
+
+        self.graph = graph
+        signature = RouteCache.graph_signature(graph)
+
+        if signature != self.signature:
+            self.entries.clear()
+            self.signature = signature
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, key, routes):
+        self.entries[key] = routes
+        self.entries.move_to_end(key)
+
+        if self.recorded is not None:
+            self.recorded.append((key, routes))
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries),
+                "hit_rate": self.hits / total if total else 0}
+
+    def start_recording(self):
+        """
+        Starts keeping the entries put in the cache, so a worker process can send them back to its parent.
+        """
+        self.recorded = []
+
+    def stop_recording(self):
+        """
+        Returns:
+            tuple: the signature of the cached routes and the entries put since start_recording, to be merged into
+            another cache.
+        """
+        recorded, self.recorded = self.recorded or [], None
+        return self.signature, recorded
+
+    def merge(self, signature, entries):
+        """
+        Adds the entries of another cache of the same graph, keeping the ones already in memory.
+        """
+        if self.signature is not None and signature != self.signature:
+            return
+
+        self.signature = signature
+
+        for key, routes in entries:
+            if key not in self.entries:
+                self.put(key, routes)
+
+    def save(self, path):
+        dill.dump((self.signature, list(self.entries.items())), open(path, 'wb'))
+
+    def load(self, path):
+        """
+        Loads the routes persisted by a previous run, keeping the ones already in memory.
+        """
+        if not Path(path).exists():
+            return
+
+        signature, entries = dill.load(open(path, 'rb'))
+        self.merge(signature, entries)
@@ -1,33 +1,56 @@
 import heapq
 import random
 
+import numpy as np
+
+from map import distance
 from map.graph import Graph
-from map.map_elements import Node, Block
+from map.map_elements import Block
+from routing.route_cache import RouteCache
 
 OBSTACLE_PENALTY_FACTOR = 1
 MAX_SPEED = 50
 MAX_WALK_SPEED = 5
 MAX_DISTANCE_TOLERANCE = 10
 ITERATIONS_FACTOR = 1000
+ROUTE_CACHE_SIZE = 4096
+
+route_cache = RouteCache(ROUTE_CACHE_SIZE)
+
+
+def heuristic(latitude, longitude, goal_latitudes, goal_longitudes, drivers_ability, walk, lower_bound=0, scale=1):
+    nearest = distance.nearest_length(latitude, longitude, goal_latitudes, goal_longitudes)
+    base_heuristic = max(nearest / (MAX_SPEED if not walk else MAX_WALK_SPEED), lower_bound) * scale
 
+    if drivers_ability >= 1:
+        return base_heuristic
 
-def heuristic(src_node, goal_nodes, drivers_ability, walk):
-    base_heuristic = min(src_node.length_to(goal_node) / (MAX_SPEED if not walk else MAX_WALK_SPEED) for goal_node in goal_nodes)
     error = 0 if random.uniform(0, 1) <= drivers_ability else base_heuristic + base_heuristic * (1 - drivers_ability)
 
     return base_heuristic + error*random.choice([-1, 1])
 
 
-def cost(graph, src_id, walk):
-    block = graph.nodes[src_id]
-    estimated_time = block.length / (int(block.max_speed) if not walk else MAX_WALK_SPEED)
-    penalty = len([element for element in block.elements if element.is_traffic_sign]) * OBSTACLE_PENALTY_FACTOR
+def edge_weights(graph):
+    return graph.edge_weights(OBSTACLE_PENALTY_FACTOR, MAX_WALK_SPEED)
+
+
+def perturbed_weights(graph, drivers_ability, seed):
+    """
+    Models the driver's knowledge of the map as a fixed perturbation of the block costs drawn from its own random
+    stream: with probability 1 - drivers_ability a block cost is over or underestimated by up to
+    (1 - drivers_ability) of its value. The same seed always yields the same perturbation.
+    """
+    weights = edge_weights(graph)
+    rng = np.random.default_rng(seed)
+
+    wrong = rng.random(weights.compact.count) > drivers_ability
+    errors = rng.uniform(-(1 - drivers_ability), 1 - drivers_ability, weights.compact.count)
 
-    return estimated_time + penalty
+    return weights.perturbed(np.where(wrong, 1 + errors, 1.0))
 
 
-def get_max_iterations(start, goals, avg_node_length):
-    path_length = max(start.length_to(goal) for goal in goals)
+def get_max_iterations(latitude, longitude, goal_latitudes, goal_longitudes, avg_node_length):
+    path_length = distance.lengths(latitude, longitude, goal_latitudes, goal_longitudes).max()
 
     avg_nodes = path_length / avg_node_length
 
@@ -35,111 +58,226 @@ def get_max_iterations(start, goals, avg_node_length):
 
 
 def path_search(graph: Graph, start_id: str, goal_ids: list[str], blocked_nodes,
-                drivers_ability: float = 1, walk: bool = False, only_walk: bool = False):
+                drivers_ability: float = 1, walk: bool = False, only_walk: bool = False, weights=None):
+    """
+    Searches the cheapest path from the start block to any of the goals with A*.
+
+    The driver's error is modelled either with random noise on the heuristic of every expanded block, when
+    drivers_ability is lower than 1, or with the block costs perturbed beforehand by perturbed_weights, in which
+    case the heuristic is kept a pure lower bound and drivers_ability is ignored.
+    """
     if len(goal_ids) == 0:
         return -1, None
 
+    compact = graph.compact()
+
+    if weights is None:
+        weights = edge_weights(graph)
+    else:
+        drivers_ability = 1
+    adjacency = weights.adjacency
+    points = compact.points
+
+    start = compact.index[start_id]
+    goals = {compact.index[goal_id] for goal_id in goal_ids}
+    blocked = {compact.index[node_id] for node_id in blocked_nodes if node_id in compact.index}
+
+    goal_positions = [compact.index[goal_id] for goal_id in goal_ids]
+    goal_latitudes = compact.latitudes[goal_positions]
+    goal_longitudes = compact.longitudes[goal_positions]
+    first_goal_latitude, first_goal_longitude = points[goal_positions[0]]
+
+    start_latitude, start_longitude = points[start]
+
+    landmarks = getattr(graph, "landmarks", None)
+    lower_bounds = (landmarks.lower_bounds(goal_positions, walk) if landmarks is not None and landmarks.matches(weights)
+                    else [0] * compact.count)
+
     open_set = []
-    goal_nodes = [graph.nodes[goal_id] for goal_id in goal_ids]
-    start_node = graph.nodes[start_id]
+    counter = 0
+
+    scale = weights.min_factor
 
-    heapq.heappush(open_set, Node(start_id, g_score=0,
-                                  f_score=heuristic(graph.nodes[start_id], goal_nodes, drivers_ability,
-                                                    walk or only_walk),
-                                  ))
+    heapq.heappush(open_set, (heuristic(start_latitude, start_longitude, goal_latitudes, goal_longitudes,
+                                        drivers_ability, walk or only_walk, lower_bounds[start], scale),
+                              counter, start, 0))
 
-    g_scores = {start_id: 0}
+    g_scores = {start: 0}
 
     came_from = {}
-    distance_from_start = start_node.length_to(goal_nodes[0])
-    multiple = len(goal_nodes) > 1
-    max_iterations = get_max_iterations(start_node, goal_nodes, graph.avg_length)
+    distance_from_start = distance.length(start_latitude, start_longitude, first_goal_latitude, first_goal_longitude)
+    multiple = len(goal_positions) > 1
+    max_iterations = get_max_iterations(start_latitude, start_longitude, goal_latitudes, goal_longitudes,
+                                        graph.avg_length)
     iterations = 0
 
     while open_set:
-        current_node = heapq.heappop(open_set)
+        _, _, current, current_g_score = heapq.heappop(open_set)
 
-        if current_node in blocked_nodes:
+        if current in blocked:
             continue
 
-        if current_node.id in goal_ids:
-            return current_node.g_score, reconstruct_path(came_from, current_node.id)
+        if current in goals:
+            return current_g_score, reconstruct_path(came_from, current, compact.ids)
 
         if multiple:
             if iterations > max_iterations:
                 return -1, None
             iterations += 1
 
-        elif (graph.nodes[current_node.id].length_to(goal_nodes[0])
+        elif (distance.length(*points[current], first_goal_latitude, first_goal_longitude)
               > distance_from_start + MAX_DISTANCE_TOLERANCE):
             continue
 
-        if current_node.id in graph.edges:
-            for neighbor_id, walk_value in graph.edges[current_node.id]:
-                if not walk and walk_value:
-                    continue
+        for neighbor, walk_value, edge_cost in adjacency[current]:
+            if not walk and walk_value:
+                continue
 
-                tentative_g_score = g_scores[current_node.id] + cost(graph, current_node.id, walk_value)
+            tentative_g_score = g_scores[current] + edge_cost
 
-                if neighbor_id not in g_scores or tentative_g_score < g_scores[neighbor_id]:
-                    came_from[neighbor_id] = current_node.id
-                    g_scores[neighbor_id] = tentative_g_score
-                    f_score = tentative_g_score + heuristic(graph.nodes[neighbor_id], goal_nodes, drivers_ability,
-                                                            walk_value or only_walk)
-                    heapq.heappush(open_set, Node(neighbor_id, g_score=tentative_g_score, f_score=f_score))
+            if neighbor not in g_scores or tentative_g_score < g_scores[neighbor]:
+                came_from[neighbor] = current
+                g_scores[neighbor] = tentative_g_score
+                f_score = tentative_g_score + heuristic(*points[neighbor], goal_latitudes, goal_longitudes,
+                                                        drivers_ability, walk_value or only_walk,
+                                                        lower_bounds[neighbor], scale)
+                counter += 1
+                heapq.heappush(open_set, (f_score, counter, neighbor, tentative_g_score))
 
     return -1, None
 
 
-def reconstruct_path(came_from, current_id):
-    path = [current_id]
-    while current_id in came_from:
-        current_id = came_from[current_id]
-        path.append(current_id)
+def multi_source_search(graph: Graph, start_ids, goal_ids, blocked_nodes=(), walk: bool = False):
+    """
+    Finds the cheapest path from every start block to its closest goal with a single search, running Dijkstra
+    backwards from all the goals at once until every start is settled.
+
+    Returns a dictionary from each reachable start id to a tuple (score, path), where the path goes from the start to
+    one of the goals and the score is the same cost path_search would report for it.
+    """
+    weights = edge_weights(graph)
+    compact = weights.compact
+    reverse_adjacency = weights.reverse_adjacency
+
+    blocked = {compact.index[node_id] for node_id in blocked_nodes if node_id in compact.index}
+    remaining = {compact.index[start_id] for start_id in start_ids} - blocked
+
+    scores = {}
+    next_block = {}
+    open_set = []
+
+    for goal_id in goal_ids:
+        goal = compact.index[goal_id]
+
+        if goal not in blocked and goal not in scores:
+            scores[goal] = 0
+            open_set.append((0, goal))
+
+    heapq.heapify(open_set)
+    settled = set()
+
+    while open_set and remaining:
+        current_score, current = heapq.heappop(open_set)
+
+        if current in settled:
+            continue
+
+        settled.add(current)
+        remaining.discard(current)
+
+        for source, walk_value, edge_cost in reverse_adjacency[current]:
+            if (walk_value and not walk) or source in blocked or source in settled:
+                continue
+
+            tentative_score = current_score + edge_cost
+
+            if source not in scores or tentative_score < scores[source]:
+                scores[source] = tentative_score
+                next_block[source] = current
+                heapq.heappush(open_set, (tentative_score, source))
+
+    paths = {}
+
+    for start_id in start_ids:
+        start = compact.index[start_id]
+
+        if start not in settled:
+            continue
+
+        path = [start_id]
+        current = start
+
+        while current in next_block:
+            current = next_block[current]
+            path.append(compact.ids[current])
+
+        paths[start_id] = (scores[start], path)
+
+    return paths
+
+
+def reconstruct_path(came_from, current, ids):
+    path = [ids[current]]
+    while current in came_from:
+        current = came_from[current]
+        path.append(ids[current])
     return path[::-1]
 
 
 def blocks_in_radio(graph, start_block, radio, walk):
 
-    length_to_start = {start_block.id: 0}
+    compact = graph.compact()
+    adjacency = compact.adjacency
+    stops = compact.stops.tolist()
 
-    open_set = []
+    start = compact.index[start_block.id]
+    length_to_start = {start: 0}
 
-    heapq.heappush(open_set, Node(start_block.id, g_score=0, f_score=0))
+    open_set = [(0, start)]
 
-    blocks_of_interest = {start_block} if start_block.contains_stop() else set()
+    positions_of_interest = {start} if stops[start] else set()
 
     while open_set:
-        current_node = heapq.heappop(open_set)
+        current_length, current = heapq.heappop(open_set)
 
-        if current_node.id in graph.edges:
-            for neighbor_id, walk_value in graph.edges[current_node.id]:
+        for neighbor, walk_value, edge_length in adjacency[current]:
 
-                if walk_value and not walk:
-                    continue
+            if walk_value and not walk:
+                continue
 
-                neighbor = graph.nodes[neighbor_id]
-                current_block = graph.nodes[current_node.id]
-                tentative_length = length_to_start[current_node.id] + current_block.length_to(neighbor)
+            tentative_length = length_to_start[current] + edge_length
 
-                if tentative_length > radio:
-                    continue
+            if tentative_length > radio:
+                continue
 
-                if neighbor.contains_stop():
-                    blocks_of_interest.add(neighbor)
+            if stops[neighbor]:
+                positions_of_interest.add(neighbor)
 
-                if neighbor_id not in length_to_start or tentative_length < length_to_start[neighbor_id]:
-                    length_to_start[neighbor_id] = tentative_length
-                    heapq.heappush(open_set, Node(neighbor_id, g_score=tentative_length, f_score=tentative_length))
+            if neighbor not in length_to_start or tentative_length < length_to_start[neighbor]:
+                length_to_start[neighbor] = tentative_length
+                heapq.heappush(open_set, (tentative_length, neighbor))
 
-    return blocks_of_interest
+    return {graph.nodes[compact.ids[position]] for position in positions_of_interest}
 
 
-def get_routes(graph, src, dest, radio):
+def get_routes(graph, src, dest, radio, walk=False):
 
     if not graph.is_simplified:
         raise ValueError("Graph is not simplified")
 
+    route_cache.bind(graph)
+    key = RouteCache.key(src, dest, radio, "walk" if walk else "drive")
+    possible_paths = route_cache.get(key)
+
+    if possible_paths is None:
+        possible_paths = search_routes(graph, src, dest, radio, walk)
+        route_cache.put(key, possible_paths)
+
+    return possible_paths
+
+
+def search_routes(graph, src, dest, radio, walk):
+
     possible_starts = blocks_in_radio(graph, src, radio, True)
     possible_ends = set()
 
@@ -154,14 +292,17 @@ def get_routes(graph, src, dest, radio):
 
     possible_paths = []
 
+    paths = multi_source_search(graph, [start.id for start in possible_starts], [end.id for end in possible_ends],
+                                walk=walk)
+
     for start in possible_starts:
 
-        possible_path = []
+        if start.id not in paths:
+            continue
 
-        score, path = path_search(graph, start.id, [end.id for end in possible_ends], [], 1)
+        possible_path = []
 
-        if score == -1:
-            continue
+        score, path = paths[start.id]
 
         last_ways = {"walk"}
         last_node = None
@@ -1,28 +1,58 @@
-import heapq
+import io
 import json
-import logging
+import multiprocessing
+import os
 import random
+import threading
 from datetime import datetime
 from pathlib import Path
 from collections.abc import Iterable
 
 import dill
+import numpy as np
+from numpy.random import SeedSequence
 
 from agents.bus_driver_agent import BusDriverAgent
-from agents.passenger_agent import PassengerAgent
-from environment.environment import DriverEnvironment, Bus, PassengerEnvironment
+from agents.passenger_agent import PassengerAgent, PassengerStatus
+from artifacts.store import ArtifactStore, CodeInput, FileInput, StageInput
+from environment.environment import DriverEnvironment, Bus, PassengerEnvironment, NO_DRIVER
+from environment.stop_index import StopIndex
 from events.event import Event, EventType
-from gemini.llm import minimum_fuel_level
+from events.scheduler import SCHEDULERS
+from gemini.parameters import ParameterProvider
+from logs.metrics import EventMetrics
+from logs.recorder import EventRecorder, DRIVER_AGENT_RECORD
 from population.generator import PopulationGenerator
+from map.map_elements import Block
 from map.map_loader import MapLoader
+from routing.routing import route_cache
 
 TIME_BETWEEN_DEPARTURES = 30
 WAIT_TIME = 5
+PASSENGERS_CHUNK_SIZE = 64
+END_TIME = 1440
+
+# attributes of the simulation saved by snapshots, the maps, the population and the schools are shared with the
+# simulation they are restored into
+SNAPSHOT_FIELDS = ("time", "processed_events", "events", "agents", "environments", "stops", "metrics", "passengers",
+                   "drivers", "min_fuel_by_model")
+
+# simulation whose maps and population are inherited by the forked passenger initialization workers
+shared_simulation = None
+
+
+def initialize_passenger_chunk(task):
+    positions, seed = task
+
+    # the routes computed by the worker are sent back with the passengers, so the parent persists them
+    route_cache.start_recording()
+    passengers = shared_simulation.initialize_passenger_chunk(positions, seed)
+    return shared_simulation.dump_agents((passengers, route_cache.stop_recording()))
 
 
 class Simulation:
     def __init__(self, maps_path, population_path, population_size, data_path, bus_distributions, start_time,
-                 analyzed_municipalities):
+                 analyzed_municipalities, seed=None, workers=None, scheduler="calendar", record_sampling=1):
         """
         Initializes a Simulation object.
         Args:
@@ -33,14 +63,32 @@ class Simulation:
             bus_distributions: amount of buses per route
             start_time: time at which the simulation starts.
             analyzed_municipalities: municipalities to analyze.
+            seed: seed of the random decisions taken while initializing the agents, random if None.
+            workers: amount of processes used to initialize the passengers, all the cpus if None.
+            scheduler: name of the event scheduler, "calendar" or "heap".
+            record_sampling: the events of one of every record_sampling agents are written to sim_<date>.npy, none if 0.
 
         """
 
-        self.events = []
+        self.seed = seed
+        self.workers = workers or os.cpu_count() or 1
+
+        if seed is not None:
+            random.seed(seed)
+
+        self.store = ArtifactStore(f"{data_path}/artifacts")
+        self.parameters = ParameterProvider(f"{data_path}/parameters.json")
+
+        self.events = SCHEDULERS[scheduler]()
+        self.agents = []
         self.time = 0
-        self.passengers_waiting = {}
-        self.passengers_on_vehicle = {}
-        self.environments = {}
+        self.processed_events = 0
+        self.environments = []
+        self.stops = StopIndex()
+        self.metrics = EventMetrics()
+
+        self.stop_requested = threading.Event()
+        self.run_lock = threading.Lock()
 
         self.routes_graph = None
         self.complete_graph = None
@@ -62,28 +110,33 @@ class Simulation:
 
         now = datetime.now()
         formatted_date = now.strftime("%Y-%m-%d_%H-%M-%S")
-        logging.basicConfig(
-            filename=f'sim_{formatted_date}.log',
-            level=logging.INFO
-        )
+        self.recorder = EventRecorder(f'sim_{formatted_date}.npy', record_sampling)
 
     def initialize_maps(self, maps_path):
 
         loader = MapLoader(f"{maps_path}/havana.osm",
                            f"{maps_path}/municipalities.poly",
                            self.analyzed_municipalities)
-        self.complete_graph, self.routes_graph = loader.load_maps(maps_path, f"{maps_path}/GAZelles.json")
+        self.complete_graph, self.routes_graph = loader.load_maps(maps_path, f"{maps_path}/GAZelles.json",
+                                                                  self.store, mapped=True)
 
     def initialize_population(self, population_path, population_size):
 
-        generator = PopulationGenerator(population_path)
+        generator = PopulationGenerator(population_path, self.store, self.parameters)
         self.population = generator.generate_population(population_size)
 
     def initialize_schools(self, schools_path):
 
-        if Path(f"{schools_path}/schools.pkl").exists():
-            self.schools = dill.load(open(f"{schools_path}/schools.pkl", "rb"))
-            return
+        self.schools = self.store.load_or_build(
+            "schools",
+            [FileInput(f"{schools_path}/schools.json"), sorted(self.analyzed_municipalities), self.seed,
+             StageInput("graph"), StageInput("simplified_graph"), CodeInput("simulation")],
+            lambda: self.build_schools(schools_path),
+            expected_type=dict)
+
+    def build_schools(self, schools_path):
+
+        schools = {}
 
         with open(f"{schools_path}/schools.json", 'r') as file:
             data = json.load(file)
@@ -109,57 +162,187 @@ class Simulation:
                 else:
                     selected_schools = self.get_nodes_in_route(key, quantity)
 
-                self.schools[(key, stype)] = selected_schools
+                schools[(key, stype)] = selected_schools
 
         with open(f"{schools_path}/universities.json", 'r') as file:
             data = json.load(file)
 
-        if Path(schools_path).exists():
-            dill.dump(self.schools, open(f"{schools_path}/schools.pkl", 'wb'))
+        return schools
 
     def initialize_passengers(self, data_path):
 
-        if (Path(f"{data_path}/passengers.pkl").exists() and Path(f"{data_path}/passenger_events.pkl").exists()
-                and Path(f"{data_path}/passenger_environments.pkl").exists()):
-            self.passengers = dill.load(open(f"{data_path}/passengers.pkl", "rb"))
-            self.events = dill.load(open(f"{data_path}/passenger_events.pkl", "rb"))
-            self.environments = dill.load(open(f"{data_path}/passenger_environments.pkl", "rb"))
-            return
+        self.passengers, departure_times, environments = self.store.load_or_build(
+            "passengers",
+            [StageInput("population"), StageInput("schools"), StageInput("graph"), StageInput("simplified_graph"),
+             sorted(self.analyzed_municipalities), self.time, self.seed,
+             CodeInput("simulation", "agents.passenger_agent", "routing.routing", "environment.environment")],
+            lambda: self.build_passengers(data_path),
+            expected_type=tuple,
+            legacy=lambda: self.load_legacy_passengers(data_path),
+            shared=self.shared_artifacts())
+
+        for passenger, time, environment in zip(self.passengers, departure_times, environments):
+            self.register(passenger, environment)
+            self.events.push(Event(time=time, event_type=EventType.DEPARTURE, agent=passenger))
+
+    def register(self, agent, environment):
+        """
+        Gives the agent the next index of the registry, where its environment is stored too. It must be called before
+        creating any event of the agent.
+        """
+        agent.index = len(self.agents)
+        self.agents.append(agent)
+        self.environments.append(environment)
 
-        for profile in self.population:
+    def build_passengers(self, data_path):
 
-            if (profile["municipality"] not in self.analyzed_municipalities
-                    or ("workplace_location" in profile
-                        and profile["workplace_location"] not in self.analyzed_municipalities)):
-                continue
+        passengers = []
+        departure_times = []
+        environments = []
 
-            home_block = self.get_node_in_route(profile["municipality"])
+        route_cache.load(f"{data_path}/route_cache.pkl")
 
-            workplace, other_block = self.get_workplace_and_other_block(profile)
+        positions = self.passenger_positions()
 
-            plans = PassengerAgent.create_plans(profile, home_block, workplace, other_block, self.time)
+        chunks = [positions[start:start + PASSENGERS_CHUNK_SIZE]
+                  for start in range(0, len(positions), PASSENGERS_CHUNK_SIZE)]
+        seeds = [int(sequence.generate_state(1)[0]) for sequence in SeedSequence(self.seed).spawn(len(chunks))]
 
-            passenger = PassengerAgent(profile, plans, home_block, workplace, home_block)
+        for chunk in self.initialize_passenger_chunks(list(zip(chunks, seeds))):
+            for passenger, time in chunk:
+                passengers.append(passenger)
+                departure_times.append(time)
 
-            time = passenger.decide_departure_time(self.routes_graph, self.time)
+                environment = PassengerEnvironment(time=time, map=self.routes_graph, current_position=0,
+                                                   bus_at_stop="", current_bus_route="", current_driver=NO_DRIVER)
+                environments.append(environment)
 
-            if time == -1:
-                continue
+        if Path(data_path).exists():
+            route_cache.save(f"{data_path}/route_cache.pkl")
+
+        return passengers, departure_times, environments
+
+    def passenger_positions(self):
+        """
+        Returns:
+            list[int]: positions in the population of the people living and working in the analyzed municipalities.
+        """
+        return [position for position, profile in enumerate(self.population)
+                if profile["municipality"] in self.analyzed_municipalities
+                and ("workplace_location" not in profile
+                     or profile["workplace_location"] in self.analyzed_municipalities)]
+
+    def initialize_passenger_chunks(self, tasks):
+        """
+        Initializes the passengers of every chunk, in a pool of forked processes that share the maps when there is
+        more than one worker. Every chunk seeds its own random decisions, so the result does not depend on the amount
+        of workers nor on the order in which the chunks finish.
+        Args:
+            tasks (list[tuple[list[int], int]]): positions in the population and seed of every chunk.
+        Returns:
+            list[list[tuple[PassengerAgent, float]]]: the passengers of every chunk with their departure times.
+        """
+        global shared_simulation
+
+        if self.workers <= 1 or len(tasks) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            return [self.initialize_passenger_chunk(positions, seed) for positions, seed in tasks]
+
+        shared_simulation = self
+
+        try:
+            with multiprocessing.get_context("fork").Pool(min(self.workers, len(tasks))) as pool:
+                results = [self.load_agents(result) for result in pool.map(initialize_passenger_chunk, tasks)]
+        finally:
+            shared_simulation = None
+
+        chunks = []
+
+        for passengers, (signature, routes) in results:
+            chunks.append(passengers)
+            route_cache.merge(signature, routes)
+
+        return chunks
+
+    def initialize_passenger_chunk(self, positions, seed):
 
-            self.passengers.append(passenger)
+        state = random.getstate()
+        random.seed(seed)
 
-            heapq.heappush(self.events, Event(time=time,
-                                              event_type=EventType.DEPARTURE,
-                                              agent=passenger))
+        passengers = []
 
-            environment = PassengerEnvironment(time=time, map=self.routes_graph, current_position=0,
-                                               bus_at_stop="", current_bus_route="", current_driver="")
-            self.environments[f"passenger:{passenger.id}"] = environment
+        try:
+            for position in positions:
+                profile = self.population[position]
 
-            if Path(data_path).exists():
-                dill.dump(self.passengers, open(f"{data_path}/passengers.pkl", 'wb'))
-                dill.dump(self.events, open(f"{data_path}/passenger_events.pkl", 'wb'))
-                dill.dump(self.environments, open(f"{data_path}/passenger_environments.pkl", 'wb'))
+                home_block = self.get_node_in_route(profile["municipality"])
+
+                workplace, other_block = self.get_workplace_and_other_block(profile)
+
+                plans = PassengerAgent.create_plans(profile, home_block, workplace, other_block, self.time)
+
+                passenger = PassengerAgent(profile, plans, home_block, workplace, home_block)
+
+                time = passenger.decide_departure_time(self.routes_graph, self.time)
+
+                if time != -1:
+                    passengers.append((passenger, time))
+        finally:
+            random.setstate(state)
+
+        return passengers
+
+    def dump_agents(self, agents):
+        """
+        Pickles agents, or any object referencing the maps, replacing the maps and their blocks by their names and ids,
+        so they are sent between processes without copies of the maps.
+        """
+        buffer = io.BytesIO()
+        pickler = dill.Pickler(buffer)
+        pickler.persistent_id = self.snapshot_id
+        pickler.dump(agents)
+        return buffer.getvalue()
+
+    def load_agents(self, data):
+        unpickler = dill.Unpickler(io.BytesIO(data))
+        unpickler.persistent_load = self.snapshot_load
+        return unpickler.load()
+
+    def load_legacy_passengers(self, data_path):
+        """
+        Loads the passengers saved before the artifact store existed, binding their environments to the loaded maps
+        instead of the copies pickled with them. Their departure times are the initial times of their environments,
+        which were saved by agent id.
+
+        They are only adopted if they were created from the current population and maps: one passenger per person
+        of the analyzed municipalities with the same profile, living in a block of the routes graph. They were not
+        seeded, so they are never adopted by seeded simulations.
+        """
+        paths = [f"{data_path}/passengers.pkl", f"{data_path}/passenger_environments.pkl"]
+
+        if self.seed is not None or not all(Path(path).exists() for path in paths):
+            return None
+
+        passengers, environments = (dill.load(open(path, "rb")) for path in paths)
+
+        profiles = [self.population[position] for position in self.passenger_positions()]
+
+        if ([passenger.profile for passenger in passengers] != profiles
+                or any(passenger.home_block.id not in self.routes_graph.nodes for passenger in passengers)):
+            return None
+
+        environments = [environments[f"passenger:{passenger.id}"] for passenger in passengers]
+
+        for environment in environments:
+            environment.map = self.routes_graph
+            environment.current_driver = NO_DRIVER
+
+        return passengers, [environment.time for environment in environments], environments
+
+    def shared_artifacts(self):
+        """
+        Objects referenced by the saved agents and environments that are loaded on their own.
+        """
+        return {"routes_graph": self.routes_graph, "complete_graph": self.complete_graph}
 
     def get_workplace_and_other_block(self, profile):
 
@@ -206,16 +389,35 @@ class Simulation:
 
         return result
 
-    def initialize_drivers(self, bus_distributions, start_time, data_path):
+    def initialize_drivers(self, bus_distributions, start_time, data_path,
+                           time_between_departures=TIME_BETWEEN_DEPARTURES):
 
-        if (Path(f"{data_path}/drivers.pkl").exists() and Path(f"{data_path}/drivers_events.pkl").exists()
-                and Path(f"{data_path}/drivers_environments.pkl").exists()):
+        drivers, departure_times, environments, self.min_fuel_by_model = self.store.load_or_build(
+            "drivers",
+            [bus_distributions, start_time, time_between_departures, WAIT_TIME, self.seed, self.parameters.backend.name,
+             StageInput("graph"),
+             StageInput("simplified_graph"),
+             CodeInput("simulation", "agents.bus_driver_agent", "environment.environment")],
+            lambda: self.build_drivers(bus_distributions, start_time, time_between_departures),
+            expected_type=tuple,
+            shared=self.shared_artifacts())
 
-            if dill.load(open(f"{data_path}/bus_distributions.pkl", "rb")) == bus_distributions:
-                self.drivers = dill.load(open(f"{data_path}/drivers.pkl", "rb"))
-                self.events.extend(dill.load(open(f"{data_path}/driver_events.pkl", "rb")))
-                self.environments |= dill.load(open(f"{data_path}/driver_environments.pkl", "rb"))
-            return
+        self.add_drivers(drivers, departure_times, environments)
+
+    def add_drivers(self, drivers, departure_times, environments):
+        """
+        Registers the drivers and schedules their departures.
+        """
+        for driver, time, environment in zip(drivers, departure_times, environments):
+            self.register(driver, environment)
+            self.drivers.append(driver)
+            self.events.push(Event(time=time, event_type=EventType.DEPARTURE, agent=driver))
+
+    def build_drivers(self, bus_distributions, start_time, time_between_departures=TIME_BETWEEN_DEPARTURES):
+
+        drivers = []
+        departure_times = []
+        environments = []
 
         gas_stations_blocks = [
             block
@@ -223,6 +425,8 @@ class Simulation:
             if place_type == "school"
         ]
 
+        self.resolve_minimum_fuel_levels(bus_distributions)
+
         for ref, quantity in bus_distributions.items():
 
             if ref not in self.complete_graph.bus_routes:
@@ -232,20 +436,13 @@ class Simulation:
 
             for i in range(quantity):
                 driver = BusDriverAgent(route, WAIT_TIME)
-                self.drivers.append(driver)
-                heapq.heappush(self.events, Event(time=start_time + i * TIME_BETWEEN_DEPARTURES,
-                                                  event_type=EventType.DEPARTURE,
-                                                  agent=driver))
+                drivers.append(driver)
+                departure_times.append(start_time + i * time_between_departures)
 
-                model, max_fuel, consumption_rate, capacity = ("MAZ-105", 300, 0.4, 160) if "P" in route.name else ("MAZ-103T", 160, 0.3, 80)
-
-                if model in self.min_fuel_by_model:
-                    min_fuel = self.min_fuel_by_model[model]
-                else:
-                    min_fuel = minimum_fuel_level(model, max_fuel)
-                    self.min_fuel_by_model[model] = min_fuel
+                model, max_fuel, consumption_rate, capacity = Simulation.bus_of_route(route)
+                min_fuel = self.min_fuel_by_model[model]
 
-                environment = DriverEnvironment(time=start_time + i * TIME_BETWEEN_DEPARTURES,
+                environment = DriverEnvironment(time=start_time + i * time_between_departures,
                                                 current_bus=Bus(max_fuel, max_fuel, min_fuel, consumption_rate,
                                                                 capacity, 0, model),
                                                 current_position=0, last_element_index=-1, map=self.routes_graph,
@@ -254,118 +451,260 @@ class Simulation:
                                                 obstacle_ahead=False,
                                                 obstacles_blocks=[])
 
-                self.environments[f"driver:{driver.id}"] = environment
+                environments.append(environment)
 
-        if Path(data_path).exists():
-            dill.dump(bus_distributions, open(f"{data_path}/bus_distributions.pkl", 'wb'))
-            dill.dump(self.drivers, open(f"{data_path}/drivers.pkl", 'wb'))
-            dill.dump([event for event in self.events if isinstance(event.agent, BusDriverAgent)],
-                      open(f"{data_path}/driver_events.pkl", 'wb'))
-            dill.dump([env for env in self.environments if isinstance(env, DriverEnvironment)],
-                      open(f"{data_path}/driver_environments.pkl", 'wb'))
+        return drivers, departure_times, environments, self.min_fuel_by_model
+
+    @staticmethod
+    def bus_of_route(route):
+        """
+        Returns:
+            tuple[str, int, float, int]: model, fuel capacity, consumption rate and capacity of the buses of the route.
+        """
+        return ("MAZ-105", 300, 0.4, 160) if "P" in route.name else ("MAZ-103T", 160, 0.3, 80)
+
+    def resolve_minimum_fuel_levels(self, bus_distributions):
+        """
+        Asks the minimum fuel levels of the bus models of the routes that are not known yet, all at once. Processes
+        forked to build drivers for these routes find them in min_fuel_by_model and never ask the parameters.
+        """
+        buses = {}
+
+        for ref in bus_distributions:
+            if ref in self.complete_graph.bus_routes:
+                model, max_fuel, _, _ = Simulation.bus_of_route(self.complete_graph.bus_routes[ref])
+                if model not in self.min_fuel_by_model:
+                    buses[model] = max_fuel
+
+        levels = self.parameters.get_many(("minimum_fuel_level", model, max_fuel) for model, max_fuel in buses.items())
+        self.min_fuel_by_model.update(zip(buses, levels))
 
     def run(self):
+        # the records are complete in the file when the run returns, a resumed run keeps appending to it
+        return self.run_until(END_TIME, close_recorder=True)
 
-        while self.events and self.time < 1440:
-            current_event = heapq.heappop(self.events)
+    def run_until(self, time, close_recorder=False):
+        """
+        Processes the pending events and expired waits that happen before the given time, or until stop is called.
+        Calling it again resumes from the first pending event.
+        Args:
+            time (float): minute of the day at which the run pauses.
+            close_recorder (bool): whether to close the recorder when the run pauses instead of only flushing it, only
+                done by the thread that ran.
+        Returns:
+            int: amount of processed events and expired waits, 0 if the simulation was already running in another
+            thread.
+        """
+        if not self.run_lock.acquire(blocking=False):
+            return 0
 
-            self.time = current_event.time
-            agent = current_event.agent
+        try:
+            processed = 0
 
-            env = self.get_environment_info(agent)
-            env.time = current_event.time
+            while (next_time := self.next_time()) is not None and next_time < time:
+                # a stop is consumed by the run it pauses, even if it was asked before the run started
+                if self.stop_requested.is_set():
+                    self.stop_requested.clear()
+                    break
 
-            undefined = "undefined"
-            logging.info(
-                f"{current_event.time}:{current_event.event_type}:{current_event.agent.id}:"
-                f"{env.current_driver if isinstance(env, PassengerEnvironment) else undefined}")
+                self.process_next()
+                processed += 1
 
-            if current_event.event_type == EventType.BOARD_VEHICLE:
+            return processed
+        finally:
+            if close_recorder:
+                self.recorder.close()
+            else:
+                self.recorder.flush()
 
-                driver_env = self.environments[f"driver:{env.current_driver}"]
+            self.run_lock.release()
 
-                if driver_env.current_bus.space():
+    def step(self, events=1):
+        """
+        Processes the next pending events, an expired wait counts as an event.
+        Args:
+            events (int): amount of events to process.
+        Returns:
+            int: amount of processed events, fewer than requested if the queue empties.
+        """
+        with self.run_lock:
+            processed = 0
 
-                    current_block_id = agent.current_route[driver_env.current_position].id
-                    waiting_passengers = self.passengers_waiting.get(current_block_id, [])
+            try:
+                while processed < events and self.next_time() is not None:
+                    self.process_next()
+                    processed += 1
 
-                    for passenger in waiting_passengers:
-                        passenger_env = self.get_environment_info(passenger)
+                return processed
+            finally:
+                self.recorder.flush()
 
-                        passenger_env.time = self.time
-                        passenger_env.bus_at_stop = env.current_bus_route
-                        passenger_env.current_driver = env.current_driver
+    def next_time(self):
+        """
+        Returns:
+            float | None: time of the next pending event or expired wait, None if there are none.
+        """
+        deadline = self.stops.next_deadline()
 
-                        action = passenger.think(current_event, passenger_env)
-                        event = passenger.take_action(action, passenger_env)
+        if self.events and (deadline is None or self.events.peek_time() <= deadline):
+            return self.events.peek_time()
 
-                        if event.event_type == EventType.BOARD_VEHICLE:
-                            driver_env.current_bus.count += 1
-                            heapq.heappush(self.events, event)
-                            break
-                    else:
-                        driver_env.onboarding = False
-                else:
-                    driver_env.onboarding = False
+        return deadline
+
+    def process_next(self):
+        deadline = self.stops.next_deadline()
+
+        # a wait expires before the next event, a bus arriving at the deadline is still taken
+        if deadline is not None and (not self.events or deadline < self.events.peek_time()):
+            self.expire_next_wait()
+            return
+
+        current_event = self.events.pop()
+
+        self.time = current_event.time
+        self.processed_events += 1
+        self.dispatch(current_event)
+
+    def dispatch(self, current_event):
+        """
+        Updates the state of the simulation with the event and lets its agent act on it.
+        """
+        agent = self.agents[current_event.agent_index]
 
-            if current_event.event_type == EventType.FUEL_SPENT:
-                env.current_bus.fuel -= env.current_bus.consumption_rate * agent.current_route[env.current_position]
+        env = self.environments[current_event.agent_index]
+        env.time = current_event.time
 
-            if current_event.event_type == EventType.BUS_STOP and not env.onboarding:
+        self.recorder.record(current_event.time, current_event.event_type.value, agent.index,
+                             self.driver_record_index(env))
+        self.metrics.record(current_event, env)
 
-                passengers_on_vehicle = self.passengers_on_vehicle.get(agent.id, [])
+        if current_event.event_type == EventType.AT_STOP:
+            self.stops.wait(agent.index, agent.current_block.id, agent.accepted_refs(env.current_position),
+                            env.time, env.time + agent.profile["max_waiting_time"])
 
-                last_leave_time = env.time
+        if current_event.event_type == EventType.BOARD_VEHICLE:
+            alighting_position = agent.alighting_position(env.current_position, env.current_bus_route)
+            self.stops.board(agent.index, env.current_driver, agent.route[alighting_position][0])
 
-                for passenger in passengers_on_vehicle:
-                    passenger_env = self.get_environment_info(passenger)
+        if current_event.event_type == EventType.GET_OFF_VEHICLE:
+            self.stops.get_off(agent.index)
 
-                    action = passenger.think(current_event, passenger_env)
-                    event = passenger.take_action(action, passenger_env)
+        if current_event.event_type == EventType.FUEL_SPENT:
+            env.current_bus.fuel -= env.current_bus.consumption_rate * agent.current_route[env.current_position]
 
-                    heapq.heappush(self.events, event)
+        if current_event.event_type == EventType.BUS_STOP:
 
-                    if event.event_type == EventType.GET_OFF_VEHICLE:
-                        last_leave_time = event.time
+            # the bus keeps waiting while the passengers of the last service are boarding
+            if env.onboarding and env.time >= env.onboarding_until:
+                env.onboarding = False
 
-                if env.current_bus.space():
+            if not env.onboarding:
+                self.serve_stop(agent, env, current_event)
+
+        action = agent.think(current_event, env)
+        self.push_events(agent.take_action(action, env))
+
+    def push_events(self, events):
+        if not isinstance(events, Iterable):
+            events = [events]
+
+        for event in events:
+            self.events.push(event)
+
+    def serve_stop(self, driver, driver_env, event):
+        """
+        Lets the passengers of the bus leaving at its current stop get off one after the other, and then the
+        passengers waiting for its route board in order of arrival while there is space, every one after the previous.
+
+        The whole stop is decided at once: the GET_OFF_VEHICLE and BOARD_VEHICLE events of the passengers are pushed
+        with cumulative times and the space of the bus is updated right away. The bus stays onboarding until the last
+        of those events, so it is not served again before they are dispatched.
+        Args:
+            driver (BusDriverAgent): driver of the bus.
+            driver_env (DriverEnvironment): environment of the driver.
+            event (Event): BUS_STOP event of the driver.
+        """
+        current_block_id = driver.current_route[driver_env.current_position].id
+        bus = driver_env.current_bus
+        time = event.time
 
-                    current_block_id = agent.current_route[env.current_position].id
-                    waiting_passengers = self.passengers_waiting.get(current_block_id, [])
+        for passenger_index in self.stops.alighting(driver.index, current_block_id):
+            passenger = self.agents[passenger_index]
+            passenger_env = self.environments[passenger_index]
 
-                    for passenger in waiting_passengers:
-                        passenger_env = self.get_environment_info(passenger)
+            passenger_env.time = time
+            passenger_env.bus_at_stop = driver.route.name
+            passenger_env.current_position = passenger.alighting_position(passenger_env.current_position,
+                                                                          passenger_env.current_bus_route)
 
-                        passenger_env.time = last_leave_time
-                        passenger_env.bus_at_stop = agent.route.name
-                        passenger_env.current_driver = agent.id
+            action = passenger.think(event, passenger_env)
+            leaving = passenger.take_action(action, passenger_env)
 
-                        action = passenger.think(current_event, passenger_env)
-                        event = passenger.take_action(action, passenger_env)
+            if isinstance(leaving, Event) and leaving.event_type == EventType.GET_OFF_VEHICLE:
+                bus.count -= 1
+                time = leaving.time
+                driver_env.onboarding = True
+                driver_env.onboarding_until = time
 
-                        if event.event_type == EventType.BOARD_VEHICLE:
-                            env.current_bus.count += 1
-                            env.onboarding = True
-                            heapq.heappush(self.events, event)
-                            break
+            self.push_events(leaving)
 
-            action = agent.think(current_event, env)
-            events = agent.take_action(action, env)
+        offer = Event(time, EventType.BUS_STOP, driver)
 
-            if not isinstance(events, Iterable):
-                events = [events]
+        for passenger_index in self.stops.waiting_for(current_block_id, driver.route.name):
 
-            for event in events:
-                heapq.heappush(self.events, event)
+            if not bus.space():
+                break
+
+            passenger = self.agents[passenger_index]
+            passenger_env = self.environments[passenger_index]
+
+            passenger_env.time = time
+            passenger_env.bus_at_stop = driver.route.name
+            passenger_env.current_driver = driver.index
+
+            action = passenger.think(offer, passenger_env)
+            boarding = passenger.take_action(action, passenger_env)
+
+            if isinstance(boarding, Event) and boarding.event_type == EventType.BOARD_VEHICLE:
+                self.stops.leave_stop(passenger_index)
+                bus.count += 1
+                time = boarding.time
+                driver_env.onboarding = True
+                driver_env.onboarding_until = time
+
+            self.push_events(boarding)
+
+    def expire_next_wait(self):
+        """
+        Removes the waiting passenger with the earliest deadline from its stop at that time and lets it search an
+        alternative, whether or not a bus serves the stop meanwhile.
+        """
+        passenger_index, deadline = self.stops.expire_next()
+        passenger = self.agents[passenger_index]
+        passenger_env = self.environments[passenger_index]
+
+        self.time = deadline
+        passenger_env.time = deadline
+        passenger_env.bus_at_stop = ""
+
+        self.push_events(passenger.take_action(PassengerStatus.SEARCH_ALTERNATIVE, passenger_env))
 
     def get_environment_info(self, agent):
-        if isinstance(agent, BusDriverAgent):
-            return self.get_driver_environment_info(agent)
+        if agent.index is None:
+            raise TypeError(f"Agent {agent} is not registered in the simulation")
+
+        return self.environments[agent.index]
 
-        if isinstance(agent, PassengerAgent):
-            return self.get_passenger_environment_info(agent)
+    @staticmethod
+    def driver_record_index(env):
+        """
+        Driver recorded for the events of an agent: the index of the driver of a passenger, NO_DRIVER if the passenger
+        is not on a vehicle and DRIVER_AGENT_RECORD for drivers.
+        """
+        if not isinstance(env, PassengerEnvironment):
+            return DRIVER_AGENT_RECORD
 
-        raise TypeError(f"Agent {agent} does not implement get_environment_info")
+        return env.current_driver
 
     def get_driver_environment_info(self, agent: BusDriverAgent):
         """
@@ -374,7 +713,7 @@ class Simulation:
             DriverEnvironment
         """
 
-        return self.environments[f"driver:{agent.id}"]
+        return self.environments[agent.index]
 
     def get_passenger_environment_info(self, agent: PassengerAgent):
         """
@@ -382,7 +721,72 @@ class Simulation:
             Returns:
                 PassengerEnvironment: A dictionary containing the environment information.
         """
-        return self.environments[f"passenger:{agent.id}"]
+        return self.environments[agent.index]
 
     def stop(self):
-        pass
+        """
+        Asks the running simulation to pause after the event it is processing, or the next run to pause before its
+        first event if none is running. run_until resumes it.
+        """
+        self.stop_requested.set()
+
+    def snapshot(self, path):
+        """
+        Saves the state of the simulation: its clock, the pending events, the agents with their environments, the
+        stops and the states of the random generators. Blocks and graphs are saved as references to the loaded maps.
+        It waits for a running simulation to stop.
+        Args:
+            path: path of the snapshot file.
+        """
+        with self.run_lock:
+            state = {field: getattr(self, field) for field in SNAPSHOT_FIELDS}
+            state["random"] = random.getstate()
+            state["numpy_random"] = np.random.get_state()
+
+            tmp_path = f"{path}.tmp"
+
+            with open(tmp_path, "wb") as file:
+                pickler = dill.Pickler(file)
+                pickler.persistent_id = self.snapshot_id
+                pickler.dump(state)
+
+            os.replace(tmp_path, path)
+
+    def restore(self, path):
+        """
+        Replaces the state of the simulation by a snapshot taken from a simulation of the same maps.
+        Args:
+            path: path of the snapshot file.
+        """
+        with self.run_lock:
+            with open(path, "rb") as file:
+                unpickler = dill.Unpickler(file)
+                unpickler.persistent_load = self.snapshot_load
+                state = unpickler.load()
+
+            random.setstate(state.pop("random"))
+            np.random.set_state(state.pop("numpy_random"))
+
+            for field in SNAPSHOT_FIELDS:
+                setattr(self, field, state[field])
+
+    def snapshot_id(self, obj):
+        if obj is self.routes_graph:
+            return "routes_graph"
+
+        if obj is self.complete_graph:
+            return "complete_graph"
+
+        if isinstance(obj, Block):
+            for name in ("complete_graph", "routes_graph"):
+                if getattr(self, name).nodes.get(obj.id) is obj:
+                    return name, obj.id
+
+        return None
+
+    def snapshot_load(self, persistent_id):
+        if isinstance(persistent_id, tuple):
+            name, block_id = persistent_id
+            return getattr(self, name).nodes[block_id]
+
+        return getattr(self, persistent_id)